@@ -0,0 +1,109 @@
+"""create baseline schema
+
+Revision ID: 0a1b2c3d4e5f
+Revises:
+Create Date: 2026-10-17 08:41:22.107563
+
+The clients, products and favorites tables as they were created by hand
+before migrations were versioned. Every statement is IF NOT EXISTS, so
+running it against such a database only adds what is missing, an existing
+table is not altered though: compare it with this file before running
+``alembic stamp 0a1b2c3d4e5f`` instead.
+
+Lookups of app/crud and the indexes behind them:
+
+* clients by email: ix_clients_email (unique), by id: the primary key.
+* products by slug: ix_products_slug (unique), by id: the primary key.
+* a favorite of a client: the favorites primary key (client_id, product_id),
+  favorites of a product: ix_favorites_product_id.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0a1b2c3d4e5f"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_updated_at_column()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.updated_at = now();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS clients (
+            id serial PRIMARY KEY,
+            name text NOT NULL,
+            email text NOT NULL,
+            salt text NOT NULL,
+            hashed_password text NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            updated_at timestamptz NOT NULL DEFAULT now()
+        )
+        """
+    )
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_clients_email ON clients (email)"
+    )
+
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id serial PRIMARY KEY,
+            slug text NOT NULL,
+            title text NOT NULL,
+            brand text NOT NULL,
+            image text NOT NULL,
+            preco text NOT NULL,
+            reviewscore text NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            updated_at timestamptz NOT NULL DEFAULT now()
+        )
+        """
+    )
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_products_slug ON products (slug)"
+    )
+
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS favorites (
+            client_id integer NOT NULL
+                REFERENCES clients (id) ON DELETE CASCADE,
+            product_id integer NOT NULL
+                REFERENCES products (id) ON DELETE CASCADE,
+            PRIMARY KEY (client_id, product_id)
+        )
+        """
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_favorites_product_id ON favorites (product_id)"
+    )
+
+    for table in ("clients", "products"):
+        op.execute(f"DROP TRIGGER IF EXISTS update_{table}_modtime ON {table}")
+        op.execute(
+            f"""
+            CREATE TRIGGER update_{table}_modtime
+            BEFORE UPDATE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column()
+            """
+        )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS favorites")
+    op.execute("DROP TABLE IF EXISTS products")
+    op.execute("DROP TABLE IF EXISTS clients")
+    op.execute("DROP FUNCTION IF EXISTS update_updated_at_column()")
@@ -0,0 +1,39 @@
+"""add favorites_count to products
+
+Revision ID: 3f1c2a9d8b7e
+Revises: 0a1b2c3d4e5f
+Create Date: 2026-10-17 09:12:40.318211
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1c2a9d8b7e"
+down_revision = "0a1b2c3d4e5f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "products",
+        sa.Column("favorites_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+        UPDATE products p
+        SET favorites_count = f.favorites_count
+        FROM (
+            SELECT product_id, count(*) AS favorites_count
+            FROM favorites
+            GROUP BY product_id
+        ) f
+        WHERE f.product_id = p.id
+        """
+    )
+
+
+def downgrade():
+    op.drop_column("products", "favorites_count")
@@ -0,0 +1,71 @@
+"""add products search indexes
+
+Revision ID: 8b2d4e6f1a3c
+Revises: 3f1c2a9d8b7e
+Create Date: 2026-10-17 14:03:51.904127
+
+Plans of GET /products by filter, every page is LIMIT n on (sort column, id)
+and continues with a keyset condition on the same pair:
+
+* no filter, sort by createdAt: Index Scan (Backward for createdAt) on
+  ix_products_created_at_id, stops after n rows.
+* sort by title: Index Scan on ix_products_title_id, stops after n rows.
+* brand: Index Scan on ix_products_brand_created_at_id, which is already in
+  the default order. With a title sort it is a Bitmap Index Scan on the same
+  index followed by a top-n sort of that brand only.
+* title: Bitmap Index Scan on ix_products_title_trgm for ILIKE '%...%',
+  search terms shorter than 3 characters have no trigrams to look up and
+  fall back to the sort index with a filter.
+* preco, reviewScore: Bitmap Index Scan on ix_products_preco and
+  ix_products_reviewscore.
+* favorited: Index Scan on ix_clients_email for the client, Index Scan on the
+  favorites primary key (client_id, product_id) for its favorites and a
+  Nested Loop on the products primary key, then a top-n sort of the
+  favorites of one client.
+* filters combined: BitmapAnd of the indexes above, the favorited filter is
+  a semi join on top of it.
+
+On a live table with millions of rows build these with
+CREATE INDEX CONCURRENTLY by hand before running the migration, the
+IF NOT EXISTS below makes it skip them.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "8b2d4e6f1a3c"
+down_revision = "3f1c2a9d8b7e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_title_trgm "
+        "ON products USING gin (title gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_brand_created_at_id "
+        "ON products (brand, created_at DESC, id DESC)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_created_at_id "
+        "ON products (created_at DESC, id DESC)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_title_id ON products (title, id)"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_products_preco ON products (preco)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_reviewscore ON products (reviewscore)"
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_products_reviewscore")
+    op.execute("DROP INDEX IF EXISTS ix_products_preco")
+    op.execute("DROP INDEX IF EXISTS ix_products_title_id")
+    op.execute("DROP INDEX IF EXISTS ix_products_created_at_id")
+    op.execute("DROP INDEX IF EXISTS ix_products_brand_created_at_id")
+    op.execute("DROP INDEX IF EXISTS ix_products_title_trgm")
@@ -0,0 +1,68 @@
+"""make preco and review_score numeric
+
+Revision ID: c5e7a9b1d3f2
+Revises: 8b2d4e6f1a3c
+Create Date: 2026-10-17 16:27:09.550382
+
+preco becomes numeric(12, 2) and reviewScore becomes review_score
+numeric(5, 2). Values are converted in place, a decimal comma is accepted,
+anything else that does not parse as a number makes the migration fail
+instead of being lost.
+
+Plans of GET /products with the new parameters:
+
+* precoMin/precoMax: Index Scan on ix_products_preco_id for the range,
+  with sort=preco or -preco it is already in order and stops after n rows.
+* reviewScoreMin/reviewScoreMax: the same on ix_products_review_score_id.
+* a range with another sort: Bitmap Index Scan on the range index followed
+  by a top-n sort of the rows in the range.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c5e7a9b1d3f2"
+down_revision = "8b2d4e6f1a3c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("DROP INDEX IF EXISTS ix_products_preco")
+    op.execute("DROP INDEX IF EXISTS ix_products_reviewscore")
+    op.execute(
+        """
+        ALTER TABLE products
+            ALTER COLUMN preco TYPE numeric(12, 2)
+                USING replace(trim(preco), ',', '.')::numeric,
+            ALTER COLUMN preco SET NOT NULL,
+            ALTER COLUMN reviewscore TYPE numeric(5, 2)
+                USING replace(trim(reviewscore), ',', '.')::numeric,
+            ALTER COLUMN reviewscore SET NOT NULL
+        """
+    )
+    op.execute("ALTER TABLE products RENAME COLUMN reviewscore TO review_score")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_preco_id ON products (preco, id)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_review_score_id "
+        "ON products (review_score, id)"
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_products_review_score_id")
+    op.execute("DROP INDEX IF EXISTS ix_products_preco_id")
+    op.execute("ALTER TABLE products RENAME COLUMN review_score TO reviewscore")
+    op.execute(
+        """
+        ALTER TABLE products
+            ALTER COLUMN preco TYPE text USING preco::text,
+            ALTER COLUMN reviewscore TYPE text USING reviewscore::text
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_products_preco ON products (preco)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_products_reviewscore ON products (reviewscore)"
+    )
@@ -0,0 +1,38 @@
+"""add created_at to favorites
+
+Revision ID: e2a4c6b8d0f1
+Revises: c5e7a9b1d3f2
+Create Date: 2026-10-17 18:42:15.208364
+
+Favorites that already exist get the time of the migration. Plan of
+GET /client/favorites: Index Scan on ix_favorites_client_id_created_at for
+the client, already in (created_at, product_id) order and continued with a
+keyset condition on the same pair, with a Nested Loop on the products
+primary key, stops after n rows however many favorites the client has.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "e2a4c6b8d0f1"
+down_revision = "c5e7a9b1d3f2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        ALTER TABLE favorites
+            ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now()
+        """
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_favorites_client_id_created_at "
+        "ON favorites (client_id, created_at DESC, product_id DESC)"
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_favorites_client_id_created_at")
+    op.execute("ALTER TABLE favorites DROP COLUMN IF EXISTS created_at")
@@ -0,0 +1,76 @@
+"""add version to products
+
+Revision ID: f4b6d8a0c2e3
+Revises: e2a4c6b8d0f1
+Create Date: 2026-10-18 10:05:37.114820
+
+version and modified_at change with every update of a product, favorites_count
+included, and are what ETag and Last-Modified of product reads are based on.
+updated_at only changes when the product itself is edited.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "f4b6d8a0c2e3"
+down_revision = "e2a4c6b8d0f1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("DROP TRIGGER IF EXISTS update_products_modtime ON products")
+    op.execute(
+        """
+        ALTER TABLE products
+            ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS modified_at timestamptz NOT NULL DEFAULT now()
+        """
+    )
+    op.execute("UPDATE products SET modified_at = greatest(updated_at, created_at)")
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_products_version()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.version = OLD.version + 1;
+            NEW.modified_at = now();
+            IF (NEW.slug, NEW.title, NEW.brand, NEW.image, NEW.preco, NEW.review_score)
+                IS DISTINCT FROM
+                (OLD.slug, OLD.title, OLD.brand, OLD.image, OLD.preco, OLD.review_score)
+            THEN
+                NEW.updated_at = now();
+            ELSE
+                NEW.updated_at = OLD.updated_at;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER update_products_version
+        BEFORE UPDATE ON products
+        FOR EACH ROW EXECUTE PROCEDURE update_products_version()
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS update_products_version ON products")
+    op.execute("DROP FUNCTION IF EXISTS update_products_version()")
+    op.execute(
+        """
+        ALTER TABLE products
+            DROP COLUMN IF EXISTS modified_at,
+            DROP COLUMN IF EXISTS version
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER update_products_modtime
+        BEFORE UPDATE ON products
+        FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column()
+        """
+    )
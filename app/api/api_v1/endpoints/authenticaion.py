@@ -6,8 +6,14 @@ from starlette.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
 
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
 from app.core.jwt import create_access_token
+from app.core.security import hash_password
 from app.crud.shortcuts import check_free_email
-from app.crud.client import create_client, get_client_by_email
+from app.crud.client import (
+    create_client,
+    get_client_by_email,
+    invalidate_cached_clients,
+    update_client_password,
+)
 from app.db.database import DataBase, get_database
 from app.models.client import Client, ClientInCreate, ClientInLogin, ClientInResponse
 
@@ -20,16 +26,25 @@ async def login(
 ):
     async with db.pool.acquire() as conn:
         dbclient = await get_client_by_email(conn, client.email)
-        if not dbclient or not dbclient.check_password(client.password):
-            raise HTTPException(
-                status_code=HTTP_400_BAD_REQUEST, detail="Incorrect email or password"
-            )
 
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        token = create_access_token(
-            data={"email": dbclient.email}, expires_delta=access_token_expires
+    # password hashing runs in its own executor, the pool connection is not held meanwhile
+    if not dbclient or not await dbclient.check_password(client.password):
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST, detail="Incorrect email or password"
         )
-        return ClientInResponse(client=Client(**dbclient.dict(), token=token))
+
+    if dbclient.password_needs_rehash():
+        await dbclient.change_password(client.password)
+        db.mark_written(dbclient.email)
+        async with db.pool.acquire() as conn:
+            await update_client_password(conn, dbclient)
+        invalidate_cached_clients(dbclient.email)
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    token = create_access_token(
+        data={"email": dbclient.email}, expires_delta=access_token_expires
+    )
+    return ClientInResponse(client=Client(**dbclient.dict(), token=token))
 
 
 @router.post(
@@ -41,11 +56,15 @@ async def login(
 async def register(
     client: ClientInCreate = Body(..., embed=True), db: DataBase = Depends(get_database)
 ):
+    # hashing may wait on a busy executor, no pool connection is held meanwhile
+    salt, hashed_password = await hash_password(client.password)
+
+    db.mark_written(client.email)
     async with db.pool.acquire() as conn:
         await check_free_email(conn, client.email)
 
         async with conn.transaction():
-            dbclient = await create_client(conn, client)
+            dbclient = await create_client(conn, client, salt, hashed_password)
             access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
             token = create_access_token(
                 data={"email": dbclient.email}, expires_delta=access_token_expires
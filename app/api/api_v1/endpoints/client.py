@@ -1,31 +1,109 @@
-from fastapi import APIRouter, Body, Depends
+from datetime import datetime
+from typing import Optional, Tuple
 
+from fastapi import APIRouter, Body, Depends, Query
+from starlette.exceptions import HTTPException
+from starlette.status import HTTP_400_BAD_REQUEST
+
+from app.core.config import MAX_PRODUCTS_PAGE_SIZE, PRODUCTS_PAGE_SIZE
 from app.core.jwt import get_current_client_authorizer
+from app.core.security import hash_password
+from app.core.utils import create_aliased_response, decode_cursor, encode_cursor
+from app.crud.favorite import get_client_favorites
+from app.crud.favorites_buffer import favorites_buffer
 from app.crud.shortcuts import check_free_email
-from app.crud.client import update_client
+from app.crud.client import invalidate_cached_clients, update_client
 from app.db.database import DataBase, get_database
 from app.models.client import Client, ClientInResponse, ClientInUpdate
+from app.models.favorite import FavoriteFilterParams, ManyFavoritesInResponse
 
 router = APIRouter()
 
+# favorites are only listed newest first, the cursor is tagged with it all the same
+FAVORITES_CURSOR_SORT = "-favoritedAt"
+
+
+def _decode_favorites_keyset(cursor: str) -> Tuple[datetime, int]:
+    cursor_sort, value, id = decode_cursor(cursor)
+    if cursor_sort != FAVORITES_CURSOR_SORT:
+        raise ValueError("Cursor was issued for another list")
+    return datetime.fromisoformat(value), id
+
 
 @router.get("/client", response_model=ClientInResponse, tags=["clients"])
 async def retrieve_current_client(client: Client = Depends(get_current_client_authorizer())):
     return ClientInResponse(client=client)
 
 
+@router.get(
+    "/client/favorites", response_model=ManyFavoritesInResponse, tags=["clients"]
+)
+async def get_current_client_favorites(
+    product: str = Query(""),
+    limit: int = Query(None, ge=1),
+    cursor: str = Query(None),
+    client: Client = Depends(get_current_client_authorizer()),
+    db: DataBase = Depends(get_database),
+):
+    keyset: Optional[Tuple[datetime, int]] = None
+    if cursor:
+        try:
+            keyset = _decode_favorites_keyset(cursor)
+        except ValueError:
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    # toggles still queued by the write-behind mode are part of the list
+    if favorites_buffer.has_pending(client.email):
+        await favorites_buffer.flush()
+
+    filters = FavoriteFilterParams(client=client.email, product=product)
+    limit = min(limit or PRODUCTS_PAGE_SIZE, MAX_PRODUCTS_PAGE_SIZE)
+    async with db.read_pool(client.email).acquire() as conn:
+        favorites = await get_client_favorites(
+            conn, filters, limit=limit + 1, keyset=keyset
+        )
+
+    next_cursor = None
+    if len(favorites) > limit:
+        favorites = favorites[:limit]
+        last = favorites[-1]
+        next_cursor = encode_cursor(
+            FAVORITES_CURSOR_SORT, last.created_at, last.product.id
+        )
+
+    return create_aliased_response(
+        ManyFavoritesInResponse(
+            favorites=favorites,
+            favorites_count=len(favorites),
+            next_cursor=next_cursor,
+        )
+    )
+
+
 @router.put("/client", response_model=ClientInResponse, tags=["clients"])
 async def update_current_client(
     client: ClientInUpdate = Body(..., embed=True),
     current_client: Client = Depends(get_current_client_authorizer()),
     db: DataBase = Depends(get_database),
 ):
-    async with db.pool.acquire() as conn:
-        if client.email == current_client.email:
-            client.email = None
+    if client.email == current_client.email:
+        client.email = None
+
+    salt = hashed_password = None
+    if client.password:
+        # hashing may wait on a busy executor, no pool connection is held meanwhile
+        salt, hashed_password = await hash_password(client.password)
 
+    db.mark_written(current_client.email)
+    if client.email:
+        db.mark_written(client.email)
+    async with db.pool.acquire() as conn:
         await check_free_email(conn, client.email)
 
         async with conn.transaction():
-            dbclient = await update_client(conn, current_client.email, client)
-            return ClientInResponse(client=Client(**dbclient.dict(), token=current_client.token))
+            dbclient = await update_client(
+                conn, current_client.email, client, salt, hashed_password
+            )
+
+    invalidate_cached_clients(current_client.email, dbclient.email)
+    return ClientInResponse(client=Client(**dbclient.dict(), token=current_client.token))
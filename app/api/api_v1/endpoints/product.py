@@ -1,78 +1,261 @@
-from typing import Optional
+import json
+from decimal import Decimal
+from typing import Any, AsyncIterator, List, Optional, Tuple
 
 from fastapi import APIRouter, Body, Depends, Path, Query
-from fastapi.encoders import jsonable_encoder
 from slugify import slugify
 from starlette.exceptions import HTTPException
-from starlette.responses import JSONResponse
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
 from starlette.status import (
     HTTP_201_CREATED,
     HTTP_204_NO_CONTENT,
+    HTTP_304_NOT_MODIFIED,
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
+from app.core.config import (
+    FAVORITES_BATCH_MAX_SIZE,
+    FAVORITES_WRITE_BEHIND,
+    MAX_PRODUCTS_PAGE_SIZE,
+    PRODUCTS_PAGE_SIZE,
+)
 from app.core.jwt import get_current_client_authorizer
-from app.core.utils import create_aliased_response
+from app.core.singleflight import SingleFlight
+from app.core.utils import (
+    create_aliased_response,
+    decode_cursor,
+    encode_cursor,
+    http_date,
+    is_not_modified,
+    make_etag,
+    render_aliased_json,
+)
+from app.crud.favorites_buffer import favorites_buffer
 from app.crud.product import (
+    DEFAULT_PRODUCTS_SORT,
+    PRODUCTS_SORTS,
     add_product_to_favorites,
+    apply_favorites_batch,
     create_product_by_slug,
     delete_product_by_slug,
+    get_cached_product,
     get_product_by_slug,
+    get_products as get_products_page,
+    invalidate_cached_products,
+    iterate_products,
     remove_product_from_favorites,
     update_product_by_slug,
 )
+from app.crud.product_import import (
+    import_products,
+    iterate_csv_rows,
+    iterate_ndjson_rows,
+)
 from app.crud.shortcuts import (
     get_product_or_404,
 )
 from app.db.database import DataBase, get_database
+from app.models.favorite import FavoritesInBatchUpdate, ManyFavoriteStatesInResponse
 from app.models.product import (
+    Product,
+    ProductFilterParams,
     ProductInCreate,
+    ProductInDB,
     ProductInResponse,
     ProductInUpdate,
+    ProductsImportInResponse,
     ManyProductsInResponse,
 )
 from app.models.client import Client
 
 router = APIRouter()
 
+# concurrent reads of a hot product share one database round trip
+product_reads = SingleFlight("get_product")
+
+
+def _validator_headers(dbproducts: List[ProductInDB], *extra: Any) -> dict:
+    # favorited is part of the representation, so it depends on the Authorization header
+    # and goes into the ETag together with the version of every product
+    etag = make_etag(
+        *(f"{p.id}:{p.version}:{p.favorited}" for p in dbproducts), *extra
+    )
+    headers = {"ETag": etag, "Vary": "Authorization"}
+    if dbproducts:
+        headers["Last-Modified"] = http_date(max(p.modified_at for p in dbproducts))
+    return headers
+
+
+def _next_cursor(dbproduct: ProductInDB, sort: str) -> str:
+    value = getattr(dbproduct, PRODUCTS_SORTS[sort].attribute)
+    return encode_cursor(sort, value, dbproduct.id)
+
+
+def _decode_keyset(cursor: str, sort: str) -> Tuple[Any, int]:
+    # a cursor only continues the sort it was issued for
+    cursor_sort, value, id = decode_cursor(cursor)
+    if cursor_sort != sort:
+        raise ValueError("Cursor was issued for another sort")
+    return PRODUCTS_SORTS[sort].parse(value), id
+
+
+async def _stream_products(
+    db: DataBase,
+    limit: Optional[int],
+    filters: ProductFilterParams,
+    sort: str,
+    keyset: Optional[Tuple[Any, int]],
+    email: Optional[str],
+) -> AsyncIterator[bytes]:
+    products_count = 0
+    next_cursor = None
+    last_product = None
+
+    async with db.read_pool(email).acquire() as conn:
+        async with conn.transaction():
+            yield b'{"products":['
+            async for dbproduct in iterate_products(
+                conn,
+                limit=limit + 1 if limit else None,
+                filters=filters,
+                sort=sort,
+                keyset=keyset,
+                email=email,
+            ):
+                if products_count == limit:
+                    # one row past the page only tells that there is a next page
+                    next_cursor = _next_cursor(last_product, sort)
+                    continue
+
+                if products_count:
+                    yield b","
+                # the cursor keeps the stored values the rows are sorted by
+                product = Product.validate(favorites_buffer.overlay(email, dbproduct))
+                yield render_aliased_json(product)
+                products_count += 1
+                last_product = dbproduct
+
+    yield b'],"productsCount":%d,"nextCursor":%s}' % (
+        products_count,
+        json.dumps(next_cursor).encode("utf-8"),
+    )
+
 
 @router.get("/products", response_model=ManyProductsInResponse, tags=["products"])
 async def get_products(
+    request: Request,
+    title: str = Query(""),
+    brand: str = Query(""),
+    preco_min: Decimal = Query(None, alias="precoMin"),
+    preco_max: Decimal = Query(None, alias="precoMax"),
+    review_score_min: Decimal = Query(None, alias="reviewScoreMin"),
+    review_score_max: Decimal = Query(None, alias="reviewScoreMax"),
+    favorited: str = Query(""),
+    sort: str = Query(DEFAULT_PRODUCTS_SORT),
+    limit: int = Query(None, ge=1),
+    cursor: str = Query(None),
+    stream: bool = Query(False),
+    client: Optional[Client] = Depends(get_current_client_authorizer(required=False)),
     db: DataBase = Depends(get_database),
 ):
-    async with db.pool.acquire() as conn:
-        dbproducts = await get_products(
-            conn
+    if sort not in PRODUCTS_SORTS:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Sort must be one of: {', '.join(PRODUCTS_SORTS)}",
+        )
+
+    filters = ProductFilterParams(
+        title=title,
+        brand=brand,
+        preco_min=preco_min,
+        preco_max=preco_max,
+        review_score_min=review_score_min,
+        review_score_max=review_score_max,
+        favorited=favorited,
+    )
+    email = client.email if client else None
+    keyset = None
+    if cursor:
+        try:
+            keyset = _decode_keyset(cursor, sort)
+        except ValueError:
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    if stream:
+        return StreamingResponse(
+            _stream_products(db, limit, filters, sort, keyset, email),
+            media_type="application/json",
         )
-        if not dbproducts:
-            raise HTTPException(
-                status_code=HTTP_404_NOT_FOUND,
-                detail="Products not found",
-            )
 
-        return create_aliased_response(
-            ManyProductsInResponse(products=dbproducts, products_count=len(dbproducts))
+    limit = min(limit or PRODUCTS_PAGE_SIZE, MAX_PRODUCTS_PAGE_SIZE)
+    async with db.read_pool(email).acquire() as conn:
+        dbproducts = await get_products_page(
+            conn,
+            limit=limit + 1,
+            filters=filters,
+            sort=sort,
+            keyset=keyset,
+            email=email,
         )
 
+    if email:
+        dbproducts = [favorites_buffer.overlay(email, p) for p in dbproducts]
+
+    next_cursor = None
+    if len(dbproducts) > limit:
+        dbproducts = dbproducts[:limit]
+        next_cursor = _next_cursor(dbproducts[-1], sort)
+
+    # a product removed from the page does not move max(modified_at), so for lists
+    # only the ETag can answer a conditional request
+    headers = _validator_headers(dbproducts, next_cursor)
+    if is_not_modified(request, headers["ETag"]):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return create_aliased_response(
+        ManyProductsInResponse(
+            products=dbproducts,
+            products_count=len(dbproducts),
+            next_cursor=next_cursor,
+        ),
+        headers=headers,
+    )
+
+
 @router.get("/products/{slug}", response_model=ProductInResponse, tags=["products"])
 async def get_product(
+    request: Request,
     slug: str = Path(..., min_length=1),
     client: Optional[Client] = Depends(get_current_client_authorizer(required=False)),
     db: DataBase = Depends(get_database),
 ):
-    async with db.pool.acquire() as conn:
-        dbproduct = await get_product_by_slug(
-            conn, slug
-        )
-        if not dbproduct:
-            raise HTTPException(
-                status_code=HTTP_404_NOT_FOUND,
-                detail="Product with slug '{slug}' not found",
-            )
+    email = client.email if client else None
+    pool = db.read_pool(email)
 
-        return create_aliased_response(ProductInResponse(product=dbproduct))
+    async def load_product() -> ProductInDB:
+        async with pool.acquire() as conn:
+            return await get_product_or_404(conn, slug)
+
+    if email:
+        # a cached product only needs favorited, a load fetches it along, either way
+        # on one connection
+        async with pool.acquire() as conn:
+            dbproduct = await get_product_or_404(conn, slug, email)
+    else:
+        # concurrent loads of a hot product share one database round trip
+        dbproduct = get_cached_product(slug)
+        if dbproduct is None:
+            dbproduct = await product_reads.do((slug, pool is db.pool), load_product)
+    dbproduct = favorites_buffer.overlay(email, dbproduct)
+
+    headers = _validator_headers([dbproduct])
+    if is_not_modified(request, headers["ETag"], dbproduct.modified_at):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return create_aliased_response(ProductInResponse(product=dbproduct), headers=headers)
 
 
 @router.post(
@@ -86,6 +269,7 @@ async def create_new_product(
     client: Client = Depends(get_current_client_authorizer()),
     db: DataBase = Depends(get_database),
 ):
+    db.mark_written(client.email)
     async with db.pool.acquire() as conn:
         product_by_slug = await get_product_by_slug(
             conn, slugify(product.title)
@@ -101,6 +285,30 @@ async def create_new_product(
             return create_aliased_response(ProductInResponse(product=dbproduct))
 
 
+@router.post(
+    "/products/import", response_model=ProductsImportInResponse, tags=["products"]
+)
+async def bulk_import_products(
+    request: Request,
+    on_conflict: str = Query("skip", alias="onConflict", regex="^(skip|update)$"),
+    client: Client = Depends(get_current_client_authorizer()),
+    db: DataBase = Depends(get_database),
+):
+    """
+    Import products from an NDJSON body, or CSV with a header line
+    when the content type is text/csv. The body is read as it streams in.
+    """
+    if request.headers.get("content-type", "").startswith("text/csv"):
+        rows = iterate_csv_rows(request.stream())
+    else:
+        rows = iterate_ndjson_rows(request.stream())
+
+    db.mark_written(client.email)
+    result = await import_products(db.pool, rows, on_conflict=on_conflict)
+
+    return create_aliased_response(ProductsImportInResponse(result=result))
+
+
 @router.put("/products/{slug}", response_model=ProductInResponse, tags=["products"])
 async def update_product(
     slug: str = Path(..., min_length=1),
@@ -110,7 +318,14 @@ async def update_product(
     async with db.pool.acquire() as conn:
         async with conn.transaction():
             dbproduct = await update_product_by_slug(conn, slug, product)
-            return create_aliased_response(ProductInResponse(product=dbproduct))
+            if not dbproduct:
+                raise HTTPException(
+                    status_code=HTTP_404_NOT_FOUND,
+                    detail=f"Product with slug '{slug}' not found",
+                )
+
+    invalidate_cached_products(slug, dbproduct.slug)
+    return create_aliased_response(ProductInResponse(product=dbproduct))
 
 
 @router.delete("/products/{slug}", tags=["products"], status_code=HTTP_204_NO_CONTENT)
@@ -119,9 +334,41 @@ async def delete_product(
     client: Client = Depends(get_current_client_authorizer()),
     db: DataBase = Depends(get_database),
 ):
+    db.mark_written(client.email)
     async with db.pool.acquire() as conn:
         async with conn.transaction():
-            await delete_product_by_slug(conn, slug, client.clientname)
+            await delete_product_by_slug(conn, slug, client.email)
+
+    invalidate_cached_products(slug)
+
+
+@router.post(
+    "/products/favorites",
+    response_model=ManyFavoriteStatesInResponse,
+    tags=["products"],
+)
+async def update_favorites_in_batch(
+    favorites: FavoritesInBatchUpdate = Body(..., embed=True),
+    client: Client = Depends(get_current_client_authorizer()),
+    db: DataBase = Depends(get_database),
+):
+    if len(favorites.add) + len(favorites.remove) > FAVORITES_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"No more than {FAVORITES_BATCH_MAX_SIZE} favorites can be changed at once",
+        )
+
+    db.mark_written(client.email)
+    # queued toggles are older than this batch, so they must not be written after it
+    await favorites_buffer.flush()
+    async with db.pool.acquire() as conn:
+        states = await apply_favorites_batch(
+            conn, client.email, favorites.add, favorites.remove
+        )
+
+    invalidate_cached_products(*favorites.add, *favorites.remove)
+
+    return create_aliased_response(ManyFavoriteStatesInResponse(favorites=states))
 
 
 @router.post(
@@ -132,8 +379,10 @@ async def favorite_product(
     client: Client = Depends(get_current_client_authorizer()),
     db: DataBase = Depends(get_database),
 ):
+    db.mark_written(client.email)
     async with db.pool.acquire() as conn:
-        dbproduct = await get_product_or_404(conn, slug)
+        dbproduct = await get_product_or_404(conn, slug, client.email)
+        dbproduct = favorites_buffer.overlay(client.email, dbproduct)
         if dbproduct.favorited:
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST,
@@ -141,12 +390,20 @@ async def favorite_product(
             )
 
         dbproduct.favorited = True
-        dbproduct.favorites_count += 1
 
-        async with conn.transaction():
-            await add_product_to_favorites(conn, slug, client.email)
+        if FAVORITES_WRITE_BEHIND:
+            favorites_buffer.add(client.email, slug, True)
+            dbproduct.favorites_count += 1
             return create_aliased_response(ProductInResponse(product=dbproduct))
 
+        async with conn.transaction():
+            dbproduct.favorites_count = await add_product_to_favorites(
+                conn, slug, client.email
+            )
+
+    invalidate_cached_products(slug)
+    return create_aliased_response(ProductInResponse(product=dbproduct))
+
 
 @router.delete(
     "/products/{slug}/favorite", response_model=ProductInResponse, tags=["products"]
@@ -156,8 +413,10 @@ async def delete_product_from_favorites(
     client: Client = Depends(get_current_client_authorizer()),
     db: DataBase = Depends(get_database),
 ):
+    db.mark_written(client.email)
     async with db.pool.acquire() as conn:
         dbproduct = await get_product_or_404(conn, slug, client.email)
+        dbproduct = favorites_buffer.overlay(client.email, dbproduct)
 
         if not dbproduct.favorited:
             raise HTTPException(
@@ -166,8 +425,16 @@ async def delete_product_from_favorites(
             )
 
         dbproduct.favorited = False
-        dbproduct.favorites_count -= 1
 
-        async with conn.transaction():
-            await remove_product_from_favorites(conn, slug, client.email)
+        if FAVORITES_WRITE_BEHIND:
+            favorites_buffer.add(client.email, slug, False)
+            dbproduct.favorites_count -= 1
             return create_aliased_response(ProductInResponse(product=dbproduct))
+
+        async with conn.transaction():
+            dbproduct.favorites_count = await remove_product_from_favorites(
+                conn, slug, client.email
+            )
+
+    invalidate_cached_products(slug)
+    return create_aliased_response(ProductInResponse(product=dbproduct))
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import logging
+from typing import AsyncIterator
+
+from app.core.config import PRODUCTS_IMPORT_BATCH_SIZE
+from app.crud.product_import import import_products, iterate_csv_rows, iterate_ndjson_rows
+from app.db.database import db
+from app.db.db_utils import close_postgres_connection, connect_to_postgres
+
+
+async def _read_file(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def run(path: str, file_format: str, on_conflict: str, batch_size: int):
+    if file_format == "csv":
+        rows = iterate_csv_rows(_read_file(path))
+    else:
+        rows = iterate_ndjson_rows(_read_file(path))
+
+    await connect_to_postgres()
+    try:
+        result = await import_products(db.pool, rows, on_conflict, batch_size)
+    finally:
+        await close_postgres_connection()
+
+    for error in result.errors:
+        logging.warning(f"Line {error.line}: {error.detail}")
+    logging.info(
+        f"Inserted {result.inserted}, updated {result.updated}, "
+        f"skipped {result.skipped}, failed {result.failed} "
+        f"({result.rows_per_second:.0f} rows/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import products from NDJSON or CSV")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default=None)
+    parser.add_argument("--on-conflict", choices=("skip", "update"), default="skip")
+    parser.add_argument("--batch-size", type=int, default=PRODUCTS_IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    file_format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args.path, file_format, args.on_conflict, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import logging
+
+from app.crud.product import reconcile_favorites_counts
+from app.db.database import db
+from app.db.db_utils import close_postgres_connection, connect_to_postgres
+
+
+async def reconcile(batch_size: int):
+    await connect_to_postgres()
+    try:
+        last_id, repaired_total = 0, 0
+        async with db.pool.acquire() as conn:
+            while True:
+                last_id, repaired_count = await reconcile_favorites_counts(
+                    conn, last_id, batch_size
+                )
+                if last_id is None:
+                    break
+
+                repaired_total += repaired_count
+                logging.info(
+                    f"Checked products up to id {last_id}, repaired {repaired_count}"
+                )
+    finally:
+        await close_postgres_connection()
+
+    logging.info(f"Repaired favorites_count of {repaired_total} products")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recount products.favorites_count from the favorites table"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(reconcile(args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from .metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES
+
+
+class TTLCache:
+    """
+    In-process LRU mapping bounded by maxsize whose entries expire after ttl seconds.
+    Not shared between worker processes. A named cache also exports its hits,
+    misses and evictions as prometheus counters.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, name: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._hits_counter = CACHE_HITS.labels(cache=name) if name else None
+        self._misses_counter = CACHE_MISSES.labels(cache=name) if name else None
+        self._evictions_counter = CACHE_EVICTIONS.labels(cache=name) if name else None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if self._hits_counter is not None:
+                    self._hits_counter.inc()
+                return value
+
+            del self._entries[key]
+
+        self.misses += 1
+        if self._misses_counter is not None:
+            self._misses_counter.inc()
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            if self._evictions_counter is not None:
+                self._evictions_counter.inc()
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
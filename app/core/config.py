@@ -25,9 +25,87 @@ if not DATABASE_URL:
 else:
     DATABASE_URL = DatabaseURL(DATABASE_URL)
 
+# read only requests are spread over these, the primary still serves them when
+# every replica lags more than REPLICA_MAX_LAG_SECONDS
+DATABASE_REPLICA_URLS = [
+    DatabaseURL(url)
+    for url in CommaSeparatedStrings(os.getenv("DATABASE_REPLICA_URLS", ""))
+]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 1))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 1))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+READ_YOUR_WRITES_CACHE_SIZE = int(os.getenv("READ_YOUR_WRITES_CACHE_SIZE", 10000))
+
 MAX_CONNECTIONS_COUNT = int(os.getenv("MAX_CONNECTIONS_COUNT", 10))
 MIN_CONNECTIONS_COUNT = int(os.getenv("MIN_CONNECTIONS_COUNT", 10))
+# a lazy pool opens no connection when it is created, a warm-up task opens
+# MIN_CONNECTIONS_COUNT of them afterwards, started at a random point of the
+# stagger window so forked workers do not all connect at once. It leaves one
+# connection to requests and runs again every half inactive lifetime, since idle
+# connections are closed after it even below the pool min_size
+DB_POOL_LAZY = os.getenv("DB_POOL_LAZY", "true").lower() in ("1", "true", "yes")
+DB_POOL_WARMUP_STAGGER = float(os.getenv("DB_POOL_WARMUP_STAGGER", 2))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 0))  # 0 waits forever
+DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME = float(
+    os.getenv("DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME", 300)
+)
+# the adaptive mode moves the pool limit between MIN_ and MAX_CONNECTIONS_COUNT,
+# so it only has room to work when they differ
+DB_POOL_ADAPTIVE = os.getenv("DB_POOL_ADAPTIVE", "").lower() in ("1", "true", "yes")
+DB_POOL_TARGET_WAIT_MS = float(os.getenv("DB_POOL_TARGET_WAIT_MS", 5))
+DB_POOL_ADAPT_INTERVAL = float(os.getenv("DB_POOL_ADAPT_INTERVAL", 1))
+# statements kept prepared on each connection, the registered ones included
+STATEMENT_CACHE_SIZE = int(os.getenv("STATEMENT_CACHE_SIZE", 100))
+# "transaction" when connecting through a transaction-mode pooler like pgbouncer,
+# whose server connections are shared by every client transaction
+DB_POOLER_MODE = os.getenv("DB_POOLER_MODE", "").lower()
+# the pooler keeps named prepared statements across its server connections,
+# e.g. pgbouncer 1.21+ with max_prepared_statements set, see the README
+DB_POOLER_PREPARED_STATEMENTS = os.getenv(
+    "DB_POOLER_PREPARED_STATEMENTS", ""
+).lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))  # 0 disables
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(
+    os.getenv("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS", 0)
+)
+QUERY_TRACING = os.getenv("QUERY_TRACING", "true").lower() in ("1", "true", "yes")
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 100))  # 0 disables
 SECRET_KEY = Secret(os.getenv("SECRET_KEY", "secret key for project"))
 
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", 2))
+PASSWORD_HASHING_QUEUE_SIZE = int(os.getenv("PASSWORD_HASHING_QUEUE_SIZE", 64))
+
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 10000))
+
+CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", 10000))
+CLIENT_CACHE_TTL = float(os.getenv("CLIENT_CACHE_TTL", 60))
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 10000))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 30))
+
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", 20))
+MAX_PRODUCTS_PAGE_SIZE = int(os.getenv("MAX_PRODUCTS_PAGE_SIZE", 100))
+
+FAVORITES_BATCH_MAX_SIZE = int(os.getenv("FAVORITES_BATCH_MAX_SIZE", 1000))
+# favorite toggles are queued in memory and written in batches, a worker that dies
+# loses what it queued since the last flush. The queue belongs to one worker: until
+# it flushes, requests of the client served by other workers do not see the
+# toggle, and toggles of one product queued by two workers are written in the
+# order the workers flush, not the order they were made. Only enable it when a
+# client's requests stick to one worker or that staleness is acceptable
+FAVORITES_WRITE_BEHIND = os.getenv("FAVORITES_WRITE_BEHIND", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+FAVORITES_FLUSH_INTERVAL = float(os.getenv("FAVORITES_FLUSH_INTERVAL", 0.1))
+FAVORITES_FLUSH_SIZE = int(os.getenv("FAVORITES_FLUSH_SIZE", 500))
+
+PRODUCTS_IMPORT_BATCH_SIZE = int(os.getenv("PRODUCTS_IMPORT_BATCH_SIZE", 5000))
+PRODUCTS_IMPORT_MAX_ERRORS = int(os.getenv("PRODUCTS_IMPORT_MAX_ERRORS", 1000))
+
+JSON_BACKEND = os.getenv("JSON_BACKEND", "json")  # json or orjson
+
 PROJECT_NAME = os.getenv("PROJECT_NAME", "Python API application")
 ALLOWED_HOSTS = CommaSeparatedStrings(os.getenv("ALLOWED_HOSTS", ""))
@@ -8,13 +8,24 @@ from fastapi.openapi.utils import (
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
 from starlette.responses import JSONResponse
-from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY, HTTP_503_SERVICE_UNAVAILABLE
+
+from app.db.pool import PoolAcquireTimeoutError
 
 
 async def http_error_handler(request: Request, exc: HTTPException) -> JSONResponse:
     return JSONResponse({"errors": [exc.detail]}, status_code=exc.status_code)
 
 
+async def pool_acquire_timeout_error_handler(
+    request: Request, exc: PoolAcquireTimeoutError
+) -> JSONResponse:
+    return JSONResponse(
+        {"errors": ["Service is overloaded, try again later"]},
+        status_code=HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
 async def http_422_error_handler(request: Request, exc: HTTPException) -> JSONResponse:
     """
     Handler for 422 error to transform default pydantic error object to gothinkster format
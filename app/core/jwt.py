@@ -1,3 +1,5 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -7,16 +9,20 @@ from jwt import PyJWTError
 from starlette.exceptions import HTTPException
 from starlette.status import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
 
-from app.crud.client import get_client_by_email
+from app.crud.client import clients_cache, get_client_by_email
 from app.db.database import DataBase, get_database
 from app.models.token import TokenPayload
 from app.models.client import Client
 
-from .config import JWT_TOKEN_PREFIX, SECRET_KEY
+from .cache import TTLCache
+from .config import JWT_CACHE_SIZE, JWT_TOKEN_PREFIX, SECRET_KEY
 
 ALGORITHM = "HS256"
 access_token_jwt_subject = "access"
 
+# verified payloads keyed by the token digest, each entry lives until the token's exp
+decoded_tokens_cache = TTLCache(maxsize=JWT_CACHE_SIZE, name="jwt")
+
 
 def _get_authorization_token(authorization: str = Header(...)):
     token_prefix, token = authorization.split(" ")
@@ -28,24 +34,40 @@ def _get_authorization_token(authorization: str = Header(...)):
     return token
 
 
+def _decode_token(token: str) -> TokenPayload:
+    key = hashlib.sha256(token.encode()).digest()
+    token_data = decoded_tokens_cache.get(key)
+    if token_data is None:
+        payload = jwt.decode(token, str(SECRET_KEY), algorithms=[ALGORITHM])
+        token_data = TokenPayload(**payload)
+
+        expire = payload.get("exp")
+        if expire is not None:
+            decoded_tokens_cache.set(key, token_data, ttl=expire - time.time())
+
+    return token_data
+
+
 async def _get_current_client(
     db: DataBase = Depends(get_database), token: str = Depends(_get_authorization_token)
 ) -> Client:
     try:
-        payload = jwt.decode(token, str(SECRET_KEY), algorithms=[ALGORITHM])
-        token_data = TokenPayload(**payload)
+        token_data = _decode_token(token)
     except PyJWTError:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, detail="Could not validate credentials"
         )
 
-    async with db.pool.acquire() as conn:
-        dbclient = await get_client_by_email(conn, token_data.email)
+    dbclient = clients_cache.get(token_data.email)
+    if dbclient is None:
+        async with db.read_pool(token_data.email).acquire() as conn:
+            dbclient = await get_client_by_email(conn, token_data.email)
         if not dbclient:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Client not found")
 
-        client = Client(**dbclient.dict(), token=token)
-        return client
+        clients_cache.set(token_data.email, dbclient)
+
+    return Client(**dbclient.dict(), token=token)
 
 
 def _get_authorization_token_optional(authorization: str = Header(None)):
@@ -0,0 +1,202 @@
+import functools
+import inspect
+import os
+import time
+from typing import Any, Callable
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+except ImportError:  # optional, metrics are not collected without it
+    Counter = Gauge = Histogram = None
+
+METRICS_ENABLED = Histogram is not None
+
+
+class _NoopMetric:
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+def _metric(metric_class: Any, *args: Any, **kwargs: Any) -> Any:
+    if metric_class is None:
+        return _NoopMetric()
+    return metric_class(*args, **kwargs)
+
+
+# acquire waits are mostly zero on a healthy pool, so the buckets are dense at the low end
+DB_POOL_ACQUIRE_SECONDS = _metric(
+    Histogram,
+    "db_pool_acquire_seconds",
+    "Time spent waiting for a database connection",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_POOL_ACQUIRE_TIMEOUTS = _metric(
+    Counter,
+    "db_pool_acquire_timeouts_total",
+    "Database connection acquires that timed out",
+    ["pool"],
+)
+DB_POOL_CONNECTIONS_IN_USE = _metric(
+    Gauge,
+    "db_pool_connections_in_use",
+    "Database connections acquired by handlers",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CONNECTIONS_IDLE = _metric(
+    Gauge,
+    "db_pool_connections_idle",
+    "Open database connections that are not acquired",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_LIMIT = _metric(
+    Gauge,
+    "db_pool_limit",
+    "Connections handlers may hold at once, moved by the adaptive mode",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+HTTP_REQUEST_SECONDS = _metric(
+    Histogram,
+    "http_request_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route", "status"],
+)
+HTTP_REQUESTS_IN_PROGRESS = _metric(
+    Gauge,
+    "http_requests_in_progress",
+    "HTTP requests being handled",
+    multiprocess_mode="livesum",
+)
+CRUD_QUERY_SECONDS = _metric(
+    Histogram,
+    "crud_query_seconds",
+    "Time spent in app.crud functions, database round trips included",
+    ["function"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+CACHE_HITS = _metric(
+    Counter, "cache_hits_total", "Lookups answered by an in-process cache", ["cache"]
+)
+CACHE_MISSES = _metric(
+    Counter,
+    "cache_misses_total",
+    "Lookups of an in-process cache that found no live entry",
+    ["cache"],
+)
+CACHE_EVICTIONS = _metric(
+    Counter,
+    "cache_evictions_total",
+    "Entries dropped from an in-process cache to stay within its size",
+    ["cache"],
+)
+SINGLEFLIGHT_CALLS = _metric(
+    Counter,
+    "singleflight_calls_total",
+    "Loads started by a single-flight group",
+    ["group"],
+)
+SINGLEFLIGHT_COALESCED = _metric(
+    Counter,
+    "singleflight_coalesced_total",
+    "Requests that waited on a load already in flight instead of starting one",
+    ["group"],
+)
+
+# the master records the phases before the fork when the app is preloaded
+STARTUP_PHASE_SECONDS = _metric(
+    Gauge,
+    "startup_phase_seconds",
+    "Time spent in each startup phase of the app",
+    ["phase"],
+    multiprocess_mode="max",
+)
+
+FAVORITE_INTENTS_DROPPED = _metric(
+    Counter,
+    "favorite_intents_dropped_total",
+    "Queued favorite toggles given up on after their flush failed twice",
+)
+
+
+def track_query_latency(func: Callable) -> Callable:
+    """
+    Observe every call of a crud function in crud_query_seconds,
+    an async generator is observed from the call until it is exhausted or closed
+    """
+    observer = CRUD_QUERY_SECONDS.labels(
+        function=f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+    )
+
+    if inspect.isasyncgenfunction(func):
+
+        @functools.wraps(func)
+        async def generator_wrapper(*args: Any, **kwargs: Any):
+            started = time.perf_counter()
+            items = func(*args, **kwargs)
+            try:
+                async for item in items:
+                    yield item
+            finally:
+                await items.aclose()
+                observer.observe(time.perf_counter() - started)
+
+        return generator_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            observer.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def _multiprocess_dir() -> str:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get(
+        "prometheus_multiproc_dir", ""
+    )
+
+
+def _render_metrics() -> bytes:
+    if _multiprocess_dir():
+        # every worker writes its own files, the scraped worker adds them all up
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    content = await run_in_threadpool(_render_metrics)
+    return Response(content, media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,100 @@
+import functools
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from starlette.types import ASGIApp, ASGIInstance, Receive, Scope, Send
+
+from app.db.tracing import start_trace
+
+from .metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_PROGRESS
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    Records http_request_seconds by method, route template and status.
+    The router writes the matched endpoint into the scope, so the template
+    is known once the inner app returns.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Dict[Callable, str] = {}
+        self._observers: Dict[Tuple[str, str, int], Any] = {}
+
+    def __call__(self, scope: Scope) -> ASGIInstance:
+        if scope["type"] != "http":
+            return self.app(scope)
+        return functools.partial(self._handle, scope=scope)
+
+    async def _handle(self, receive: Receive, send: Send, scope: Scope):
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: dict):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            instance = self.app(scope)
+            await instance(receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            self._observer(scope, status).observe(time.perf_counter() - started)
+
+    def _observer(self, scope: Scope, status: int) -> Any:
+        route = self._route_path(scope)
+        key = (scope["method"], route, status)
+        observer = self._observers.get(key)
+        if observer is None:
+            # labels() hashes and locks on every call, children are kept per key instead
+            observer = HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status))
+            self._observers[key] = observer
+        return observer
+
+    def _route_path(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            path = UNMATCHED_ROUTE
+            for route in getattr(scope.get("router"), "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._route_paths[endpoint] = path
+        return path
+
+
+class QueryTracingMiddleware:
+    """
+    Starts a query trace for every request and sums it up in a Server-Timing header.
+    A streaming response only reports the statements run before its first chunk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def __call__(self, scope: Scope) -> ASGIInstance:
+        if scope["type"] != "http":
+            return self.app(scope)
+        return functools.partial(self._handle, scope=scope)
+
+    async def _handle(self, receive: Receive, send: Send, scope: Scope):
+        trace = start_trace()
+
+        async def send_with_server_timing(message: dict):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        instance = self.app(scope)
+        await instance(receive, send_with_server_timing)
@@ -1,16 +1,83 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
 import bcrypt
 from passlib.context import CryptContext
+from starlette.exceptions import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+from .config import BCRYPT_ROUNDS, PASSWORD_HASHING_QUEUE_SIZE, PASSWORD_HASHING_WORKERS
+
+# hashes made with any other cost are reported by needs_update and rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_hashing_executor: Optional[ThreadPoolExecutor] = None
+_hashing_pending = 0
+
+
+async def _run_in_hashing_executor(func: Callable, *args: Any) -> Any:
+    """
+    bcrypt releases the GIL, so a small thread pool keeps it off the event loop.
+    Work beyond the pool size plus the queue limit is rejected instead of piling up.
+    """
+    global _hashing_executor, _hashing_pending
+
+    if _hashing_pending >= PASSWORD_HASHING_WORKERS + PASSWORD_HASHING_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, try again later",
+        )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    if _hashing_executor is None:
+        _hashing_executor = ThreadPoolExecutor(
+            max_workers=PASSWORD_HASHING_WORKERS, thread_name_prefix="password-hashing"
+        )
+
+    _hashing_pending += 1
+    try:
+        return await asyncio.get_event_loop().run_in_executor(
+            _hashing_executor, func, *args
+        )
+    finally:
+        _hashing_pending -= 1
+
+
+def load_password_hashing_backend():
+    """
+    passlib picks and self-tests the bcrypt backend on first use, doing it up front
+    keeps that off the first login and lets a preloading server do it only once
+    """
+    pwd_context.handler().get_backend()
 
 
 def generate_salt():
     return bcrypt.gensalt().decode()
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await _run_in_hashing_executor(
+        pwd_context.verify, plain_password, hashed_password
+    )
+
+
+async def get_password_hash(password):
+    return await _run_in_hashing_executor(pwd_context.hash, password)
+
+
+async def hash_password(password: str) -> Tuple[str, str]:
+    """
+    New salt and the hash of the salted password
+    """
+    salt = generate_salt()
+    return salt, await get_password_hash(salt + password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def password_needs_rehash(hashed_password):
+    return pwd_context.needs_update(hashed_password)
@@ -0,0 +1,36 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.core.metrics import SINGLEFLIGHT_CALLS, SINGLEFLIGHT_COALESCED
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight load and get its
+    result or exception, which they must not mutate
+    """
+
+    def __init__(self, group: str):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._started = SINGLEFLIGHT_CALLS.labels(group=group)
+        self._coalesced = SINGLEFLIGHT_COALESCED.labels(group=group)
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(loader())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._forget(key, call))
+            self._started.inc()
+        else:
+            self._coalesced.inc()
+
+        # a caller that goes away, the one that started the load included,
+        # does not cancel it for the others
+        return await asyncio.shield(call)
+
+    def _forget(self, key: Hashable, call: asyncio.Future):
+        if self._calls.get(key) is call:
+            del self._calls[key]
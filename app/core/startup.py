@@ -0,0 +1,20 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from app.core.metrics import STARTUP_PHASE_SECONDS
+
+# gunicorn only emits the records of its own loggers
+logger = logging.getLogger("gunicorn.error")
+
+
+@contextmanager
+def startup_phase(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STARTUP_PHASE_SECONDS.labels(phase=name).set(duration)
+        logger.info(f"Startup phase {name} took {duration * 1000:.1f} ms")
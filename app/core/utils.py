@@ -1,7 +1,130 @@
-from fastapi.encoders import jsonable_encoder
+import base64
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, Optional, Tuple
+
 from pydantic import BaseModel
-from starlette.responses import JSONResponse
+from pydantic.json import ENCODERS_BY_TYPE
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .config import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:  # optional, only used with JSON_BACKEND=orjson
+    orjson = None
+
+if JSON_BACKEND == "orjson" and orjson is None:
+    logging.warning("JSON_BACKEND is orjson but orjson is not installed, using json")
+
+
+def _json_default(json_encoders: dict) -> Callable[[Any], Any]:
+    # same lookup jsonable_encoder does: encoders of the model config, then pydantic's
+    def default(obj: Any) -> Any:
+        encoder = json_encoders.get(type(obj)) or ENCODERS_BY_TYPE.get(type(obj))
+        if encoder is None:
+            raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+        return encoder(obj)
+
+    return default
+
+
+def render_aliased_json(model: BaseModel) -> bytes:
+    """
+    Serialize model with aliases in one pass, producing the same bytes as
+    JSONResponse(content=jsonable_encoder(model, by_alias=True)) did.
+    With the orjson backend floats that need an exponent (below 1e-4 or from 1e16 on)
+    are written differently, the rest is identical.
+    """
+    content = model.dict(by_alias=True)
+    default = _json_default(model.Config.json_encoders)
+
+    if JSON_BACKEND == "orjson" and orjson is not None:
+        return orjson.dumps(
+            content, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+    return json.dumps(
+        content,
+        default=default,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class AliasedModelResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return render_aliased_json(content)
+
+
+def create_aliased_response(model: BaseModel, headers: dict = None) -> Response:
+    return AliasedModelResponse(content=model, headers=headers)
+
+
+def encode_cursor(sort: str, value: Any, id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, str(value), id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str, int]:
+    """
+    Raises ValueError if cursor was not produced by encode_cursor
+    """
+    try:
+        sort, value, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except TypeError:
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(part, t) for part, t in ((sort, str), (value, str), (id, int))):
+        raise ValueError("Invalid cursor")
+    return sort, value, id
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # naive timestamps are stored in UTC, same as RWModel assumes when encoding them
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def http_date(dt: datetime) -> str:
+    return format_datetime(_as_utc(dt), usegmt=True)
+
+
+def is_not_modified(
+    request: Request, etag: str, last_modified: Optional[datetime] = None
+) -> bool:
+    """
+    Evaluate If-None-Match, or If-Modified-Since when there is no If-None-Match
+    and last_modified is given
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
 
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            modified_since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if modified_since.tzinfo is None:
+            modified_since = modified_since.replace(tzinfo=timezone.utc)
+        return _as_utc(last_modified).replace(microsecond=0) <= modified_since
 
-def create_aliased_response(model: BaseModel) -> JSONResponse:
-    return JSONResponse(content=jsonable_encoder(model, by_alias=True))
+    return False
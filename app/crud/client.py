@@ -1,47 +1,95 @@
-from asyncpg import Connection
+from typing import Optional
+
 from pydantic import EmailStr
 
+from app.core.cache import TTLCache
+from app.core.config import CLIENT_CACHE_SIZE, CLIENT_CACHE_TTL
+from app.core.metrics import track_query_latency
+from app.db.connection import Connection
+from app.db.statements import register
 from app.models.client import ClientInCreate, ClientInDB, ClientInUpdate
 
+# resolved clients of authenticated requests, keyed by the email of the token subject
+clients_cache = TTLCache(
+    maxsize=CLIENT_CACHE_SIZE, ttl=CLIENT_CACHE_TTL, name="clients"
+)
+
+GET_CLIENT = register(
+    "get_client",
+    """
+    SELECT id, name, email, salt, hashed_password, created_at, updated_at
+    FROM clients
+    WHERE name = $1
+    """,
+)
+
+GET_CLIENT_BY_EMAIL = register(
+    "get_client_by_email",
+    """
+    SELECT id, name, email, salt, hashed_password, created_at, updated_at
+    FROM clients
+    WHERE email = $1
+    """,
+)
+
+CREATE_CLIENT = register(
+    "create_client",
+    """
+    INSERT INTO clients (name, email, salt, hashed_password)
+    VALUES ($1, $2, $3, $4)
+    RETURNING id, created_at, updated_at
+    """,
+)
+
+UPDATE_CLIENT = register(
+    "update_client",
+    """
+    UPDATE clients
+    SET name = $1, email = $2, salt = $3, hashed_password = $4
+    WHERE email = $5
+    RETURNING updated_at
+    """,
+)
 
+UPDATE_CLIENT_PASSWORD = register(
+    "update_client_password",
+    """
+    UPDATE clients
+    SET salt = $1, hashed_password = $2
+    WHERE id = $3
+    RETURNING updated_at
+    """,
+)
+
+
+@track_query_latency
 async def get_client(conn: Connection, name: str) -> ClientInDB:
-    row = await conn.fetchrow(
-        """
-        SELECT id, name, email, hashed_password, created_at, updated_at
-        FROM clients
-        WHERE name = $1
-        """,
-        name,
-    )
+    row = await conn.fetchrow_prepared(GET_CLIENT, name)
     if row:
         return ClientInDB(**row)
 
 
+@track_query_latency
 async def get_client_by_email(conn: Connection, email: EmailStr) -> ClientInDB:
-    row = await conn.fetchrow(
-        """
-        SELECT id, name, email, hashed_password, created_at, updated_at
-        FROM clients
-        WHERE email = $1
-        """,
-        email,
-    )
+    row = await conn.fetchrow_prepared(GET_CLIENT_BY_EMAIL, email)
     if row:
         return ClientInDB(**row)
 
 
-async def create_client(conn: Connection, client: ClientInCreate) -> ClientInDB:
-    dbclient = ClientInDB(**client.dict())
-    dbclient.change_password(client.password)
+@track_query_latency
+async def create_client(
+    conn: Connection, client: ClientInCreate, salt: str, hashed_password: str
+) -> ClientInDB:
+    """
+    The password is hashed by the caller, before it holds a connection
+    """
+    dbclient = ClientInDB(**client.dict(), salt=salt, hashed_password=hashed_password)
 
-    row = await conn.fetchrow(
-        """
-        INSERT INTO clients (name, email, hashed_password) 
-        VALUES ($1, $2, $3, $4)
-        RETURNING id, created_at, updated_at
-        """,
+    row = await conn.fetchrow_prepared(
+        CREATE_CLIENT,
         dbclient.name,
         dbclient.email,
+        dbclient.salt,
         dbclient.hashed_password,
     )
 
@@ -52,26 +100,48 @@ async def create_client(conn: Connection, client: ClientInCreate) -> ClientInDB:
     return dbclient
 
 
-async def update_client(conn: Connection, email: str, client: ClientInUpdate) -> ClientInDB:
+@track_query_latency
+async def update_client(
+    conn: Connection,
+    email: str,
+    client: ClientInUpdate,
+    salt: Optional[str] = None,
+    hashed_password: Optional[str] = None,
+) -> ClientInDB:
+    """
+    A new password is hashed by the caller, before it holds a connection
+    """
     dbclient = await get_client_by_email(conn, email)
 
     dbclient.name = client.name or dbclient.name
     dbclient.email = client.email or dbclient.email
-    if client.password:
-        dbclient.change_password(client.password)
-
-    updated_at = await conn.fetchval(
-        """
-        UPDATE clients
-        SET name = $1, email = $2, hashed_password = $3
-        WHERE name = $4
-        RETURNING updated_at
-        """,
+    if hashed_password:
+        dbclient.salt, dbclient.hashed_password = salt, hashed_password
+
+    updated_at = await conn.fetchval_prepared(
+        UPDATE_CLIENT,
         dbclient.name,
         dbclient.email,
+        dbclient.salt,
         dbclient.hashed_password,
-        name,
+        email,
     )
 
     dbclient.updated_at = updated_at
     return dbclient
+
+
+@track_query_latency
+async def update_client_password(conn: Connection, dbclient: ClientInDB):
+    dbclient.updated_at = await conn.fetchval_prepared(
+        UPDATE_CLIENT_PASSWORD, dbclient.salt, dbclient.hashed_password, dbclient.id
+    )
+
+
+def invalidate_cached_clients(*emails: str):
+    """
+    Must be called once the change is committed, a read that runs before the commit
+    would cache the old row again
+    """
+    for email in emails:
+        clients_cache.pop(email)
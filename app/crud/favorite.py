@@ -0,0 +1,89 @@
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from app.core.metrics import track_query_latency
+from app.db.connection import Connection
+from app.models.client import ClientBase
+from app.models.favorite import Favorite, FavoriteFilterParams
+from app.models.product import ProductInDB
+
+from .product import _escape_like
+
+
+def _client_favorites_query(
+    filters: FavoriteFilterParams,
+    keyset: Optional[Tuple[datetime, int]],
+    limit: int,
+) -> Tuple[str, List[Any]]:
+    # newest first, see the favorites created_at migration for the plan
+    conditions = ["c.email = $1"]
+    args: List[Any] = [filters.client]
+
+    if keyset is not None:
+        args.extend(keyset)
+        conditions.append(
+            f"(f.created_at, f.product_id) < (${len(args) - 1}, ${len(args)})"
+        )
+    if filters.product:
+        args.append(f"%{_escape_like(filters.product)}%")
+        conditions.append(f"p.title ILIKE ${len(args)}")
+
+    args.append(limit)
+    query = f"""
+    SELECT
+        c.name AS client_name,
+        c.email AS client_email,
+        f.created_at AS favorited_at,
+        p.id,
+        p.slug,
+        p.title,
+        p.brand,
+        p.image,
+        p.preco,
+        p.review_score,
+        p.favorites_count,
+        p.created_at,
+        p.updated_at,
+        p.version,
+        p.modified_at,
+        TRUE AS favorited
+    FROM clients c
+    JOIN favorites f ON f.client_id = c.id
+    JOIN products p ON p.id = f.product_id
+    WHERE {" AND ".join(conditions)}
+    ORDER BY f.created_at DESC, f.product_id DESC
+    LIMIT ${len(args)}
+    """
+    return query, args
+
+
+@track_query_latency
+async def get_client_favorites(
+    conn: Connection,
+    filters: FavoriteFilterParams,
+    limit: int,
+    keyset: Optional[Tuple[datetime, int]] = None,
+) -> List[Favorite]:
+    """
+    Favorites of filters.client with their products in one round trip,
+    keyset continues after the (created_at, product id) of the previous page
+    """
+    query, args = _client_favorites_query(filters, keyset, limit)
+    rows = await conn.fetch(query, *args)
+
+    favorites = []
+    client = None
+    for row in rows:
+        row = dict(row)
+        client_name, client_email = row.pop("client_name"), row.pop("client_email")
+        if client is None:
+            client = ClientBase(name=client_name, email=client_email)
+        favorites.append(
+            Favorite(
+                client=client,
+                created_at=row.pop("favorited_at"),
+                updated_at=None,
+                product=ProductInDB(**row),
+            )
+        )
+    return favorites
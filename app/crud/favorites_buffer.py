@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import FAVORITES_FLUSH_INTERVAL, FAVORITES_FLUSH_SIZE
+from app.core.metrics import FAVORITE_INTENTS_DROPPED
+from app.db.database import db
+from app.models.product import ProductInDB
+
+from .product import apply_favorite_intents, invalidate_cached_products
+
+# (client email, product slug)
+IntentKey = Tuple[str, str]
+
+
+class FavoritesBuffer:
+    """
+    Write-behind queue of favorite toggles. Only the last intent of a client for
+    a product is kept, they are written in one statement every flush_interval
+    seconds or as soon as flush_size of them are queued.
+    """
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._intents: Dict[IntentKey, bool] = OrderedDict()
+        # intents of the batch being written, still pending for readers
+        self._flushing: Dict[IntentKey, bool] = {}
+        # created by start, inside the event loop of the worker
+        self._flush_lock: asyncio.Lock = None
+        self._full: asyncio.Event = None
+
+    def __len__(self) -> int:
+        return len(self._intents)
+
+    def add(self, email: str, slug: str, favorited: bool):
+        key = (email, slug)
+        self._intents.pop(key, None)
+        self._intents[key] = favorited
+        if self._full is not None and len(self._intents) >= self.flush_size:
+            self._full.set()
+
+    def pending(self, email: str, slug: str) -> Optional[bool]:
+        key = (email, slug)
+        favorited = self._intents.get(key)
+        if favorited is None:
+            favorited = self._flushing.get(key)
+        return favorited
+
+    def has_pending(self, email: str) -> bool:
+        return any(key[0] == email for key in [*self._intents, *self._flushing])
+
+    def overlay(self, email: Optional[str], dbproduct: ProductInDB) -> ProductInDB:
+        """
+        Product as the client sees it once its queued intent is written
+        """
+        favorited = self.pending(email, dbproduct.slug) if email else None
+        if favorited is None or favorited == dbproduct.favorited:
+            return dbproduct
+
+        return dbproduct.copy(
+            update={
+                "favorited": favorited,
+                "favorites_count": dbproduct.favorites_count + (1 if favorited else -1),
+            }
+        )
+
+    async def flush(self):
+        if self._flush_lock is None:
+            # never started, nothing can be queued
+            return
+
+        # taken even when nothing is queued, so a caller that needs the intents
+        # written waits for a flush that is still writing them
+        async with self._flush_lock:
+            if not self._intents:
+                return
+
+            self._flushing, self._intents = self._intents, OrderedDict()
+            self._full.clear()
+            try:
+                await self._write(self._flushing)
+            finally:
+                self._flushing = {}
+
+    async def _write(self, intents: Dict[IntentKey, bool]):
+        emails, slugs = zip(*intents)
+        for attempt in range(2):
+            try:
+                async with db.pool.acquire() as conn:
+                    await apply_favorite_intents(
+                        conn, list(emails), list(slugs), list(intents.values())
+                    )
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt:
+                    FAVORITE_INTENTS_DROPPED.inc(len(intents))
+                    logging.error(
+                        f"Dropped {len(intents)} favorite intents, flush failed: {e!r}"
+                    )
+                    return
+                # a connection lost or a deadlock is worth one more try
+                logging.warning(f"Flushing favorite intents failed, retrying: {e!r}")
+                await asyncio.sleep(self.flush_interval)
+
+        invalidate_cached_products(*set(slugs))
+
+    def start(self) -> asyncio.Future:
+        self._flush_lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        return asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            # a flush that started finishes even when the worker shuts down
+            await asyncio.shield(self.flush())
+
+
+favorites_buffer = FavoritesBuffer(FAVORITES_FLUSH_INTERVAL, FAVORITES_FLUSH_SIZE)
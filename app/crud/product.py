@@ -1,8 +1,15 @@
-from typing import List, Optional
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator, Callable, List, NamedTuple, Optional, Tuple
 
-from asyncpg import Connection
 from slugify import slugify
 
+from app.core.cache import TTLCache
+from app.core.config import PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL
+from app.core.metrics import track_query_latency
+from app.db.connection import Connection
+from app.db.statements import register
+from app.models.favorite import FavoriteState
 from app.models.product import (
     ProductFilterParams,
     ProductInCreate,
@@ -10,181 +17,617 @@ from app.models.product import (
     ProductInUpdate,
 )
 
-from .client import get_client_by_email
+# client independent part of products keyed by slug, favorited is always stored as False
+# and filled in for the caller, so entries can be shared between clients
+products_cache = TTLCache(
+    maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL, name="products"
+)
 
+IS_PRODUCT_FAVORITED_BY_CLIENT = register(
+    "is_product_favorited_by_client",
+    """
+    SELECT EXISTS(
+        SELECT 1
+        FROM favorites f
+        JOIN clients c ON c.id = f.client_id
+        JOIN products p ON p.id = f.product_id
+        WHERE c.email = $1 AND p.slug = $2
+    ) AS favorited
+    """,
+)
 
-async def is_product_favorited_by_client(
-    conn: Connection, slug: str, email: str
-) -> bool:
-    return await conn.fetchval(
-        """
-        SELECT CASE WHEN client_id IS NULL THEN FALSE ELSE TRUE END AS favorited
-        FROM favorites
-        WHERE 
-            client_id = (SELECT id FROM clients WHERE email = $1) 
+ADD_PRODUCT_TO_FAVORITES = register(
+    "add_product_to_favorites",
+    """
+    WITH inserted AS (
+        INSERT INTO favorites (client_id, product_id)
+        SELECT c.id, p.id
+        FROM clients c, products p
+        WHERE c.email = $2 AND p.slug = $1
+        ON CONFLICT DO NOTHING
+        RETURNING product_id
+    ), updated AS (
+        UPDATE products
+        SET favorites_count = favorites_count + 1
+        WHERE id = (SELECT product_id FROM inserted)
+        RETURNING favorites_count
+    )
+    SELECT favorites_count FROM updated
+    UNION ALL
+    SELECT favorites_count FROM products
+    WHERE slug = $1 AND NOT EXISTS (SELECT 1 FROM updated)
+    """,
+)
+
+REMOVE_PRODUCT_FROM_FAVORITES = register(
+    "remove_product_from_favorites",
+    """
+    WITH deleted AS (
+        DELETE FROM favorites
+        WHERE
+            product_id = (SELECT id FROM products WHERE slug = $1)
             AND
-            product_id = (SELECT id FROM products WHERE slug = $2)
-        """,
-        email,
-        slug,
+            client_id = (SELECT id FROM clients WHERE email = $2)
+        RETURNING product_id
+    ), updated AS (
+        UPDATE products
+        SET favorites_count = favorites_count - 1
+        WHERE id = (SELECT product_id FROM deleted)
+        RETURNING favorites_count
     )
+    SELECT favorites_count FROM updated
+    UNION ALL
+    SELECT favorites_count FROM products
+    WHERE slug = $1 AND NOT EXISTS (SELECT 1 FROM updated)
+    """,
+)
 
+# intents are (slug, favorited) pairs, the last intent for a slug wins. Products are
+# locked in id order before any of them changes, so batches touching the same
+# products wait on each other instead of deadlocking, see apply_favorite_intents too
+APPLY_FAVORITES_BATCH = register(
+    "apply_favorites_batch",
+    """
+    WITH client AS (
+        SELECT id FROM clients WHERE email = $1
+    ), locked AS (
+        SELECT id, slug
+        FROM products
+        WHERE slug = ANY($2::text[])
+        ORDER BY id
+        FOR NO KEY UPDATE
+    ), intents AS (
+        SELECT DISTINCT ON (i.slug) p.id AS product_id, i.slug, i.favorited
+        FROM unnest($2::text[], $3::bool[]) WITH ORDINALITY AS i(slug, favorited, position)
+        JOIN locked p ON p.slug = i.slug
+        ORDER BY i.slug, i.position DESC
+    ), inserted AS (
+        INSERT INTO favorites (client_id, product_id)
+        SELECT client.id, intents.product_id
+        FROM client, intents
+        WHERE intents.favorited
+        ON CONFLICT DO NOTHING
+        RETURNING product_id
+    ), deleted AS (
+        DELETE FROM favorites f
+        USING client, intents
+        WHERE
+            f.client_id = client.id
+            AND
+            f.product_id = intents.product_id
+            AND
+            NOT intents.favorited
+        RETURNING f.product_id
+    ), deltas AS (
+        SELECT product_id, sum(delta) AS delta
+        FROM (
+            SELECT product_id, 1 AS delta FROM inserted
+            UNION ALL
+            SELECT product_id, -1 AS delta FROM deleted
+        ) changes
+        GROUP BY product_id
+    ), updated AS (
+        UPDATE products p
+        SET favorites_count = p.favorites_count + deltas.delta
+        FROM deltas
+        WHERE p.id = deltas.product_id
+        RETURNING p.id, p.favorites_count
+    )
+    SELECT
+        intents.slug,
+        intents.favorited,
+        COALESCE(updated.favorites_count, p.favorites_count) AS favorites_count
+    FROM intents
+    JOIN products p ON p.id = intents.product_id
+    LEFT JOIN updated ON updated.id = intents.product_id
+    """,
+)
 
-async def add_product_to_favorites(conn: Connection, slug: str, email: str):
-    await conn.execute(
-        """
-        INSERT INTO favorites (client_id, product_id) 
-        VALUES (
-            (SELECT id FROM clients WHERE email = $2),
-            (SELECT id FROM products WHERE slug = $1) 
-        )
-        """,
-        slug,
-        email,
+# favorite intents of many clients, at most one per client and product, the
+# counter of each product is updated once for the whole batch. Products are
+# locked in id order first, as in apply_favorites_batch
+APPLY_FAVORITE_INTENTS = register(
+    "apply_favorite_intents",
+    """
+    WITH locked AS (
+        SELECT id, slug
+        FROM products
+        WHERE slug = ANY($2::text[])
+        ORDER BY id
+        FOR NO KEY UPDATE
+    ), intents AS (
+        SELECT c.id AS client_id, p.id AS product_id, i.favorited
+        FROM unnest($1::text[], $2::text[], $3::bool[]) AS i(email, slug, favorited)
+        JOIN clients c ON c.email = i.email
+        JOIN locked p ON p.slug = i.slug
+    ), inserted AS (
+        INSERT INTO favorites (client_id, product_id)
+        SELECT client_id, product_id
+        FROM intents
+        WHERE favorited
+        ON CONFLICT DO NOTHING
+        RETURNING product_id
+    ), deleted AS (
+        DELETE FROM favorites f
+        USING intents
+        WHERE
+            f.client_id = intents.client_id
+            AND
+            f.product_id = intents.product_id
+            AND
+            NOT intents.favorited
+        RETURNING f.product_id
+    ), deltas AS (
+        SELECT product_id, sum(delta) AS delta
+        FROM (
+            SELECT product_id, 1 AS delta FROM inserted
+            UNION ALL
+            SELECT product_id, -1 AS delta FROM deleted
+        ) changes
+        GROUP BY product_id
     )
+    UPDATE products p
+    SET favorites_count = p.favorites_count + deltas.delta
+    FROM deltas
+    WHERE p.id = deltas.product_id AND deltas.delta <> 0
+    """,
+)
 
+GET_FAVORITES_COUNT_FOR_PRODUCT = register(
+    "get_favorites_count_for_product",
+    """
+    SELECT favorites_count
+    FROM products
+    WHERE slug = $1
+    """,
+)
 
-async def remove_product_from_favorites(conn: Connection, slug: str, email: str):
-    await conn.execute(
-        """
-        DELETE FROM favorites
-        WHERE 
-            product_id = (SELECT id FROM products WHERE slug = $1) 
-            AND 
-            client_id = (SELECT id FROM clients WHERE email = $2)
-        """,
+LOCK_PRODUCTS_BATCH = register(
+    "lock_products_batch",
+    """
+    SELECT max(id)
+    FROM (
+        SELECT id
+        FROM products
+        WHERE id > $1
+        ORDER BY id
+        LIMIT $2
+        FOR UPDATE
+    ) batch
+    """,
+)
+
+REPAIR_FAVORITES_COUNTS = register(
+    "repair_favorites_counts",
+    """
+    WITH actual AS (
+        SELECT p.id, count(f.product_id) AS favorites_count
+        FROM products p
+        LEFT JOIN favorites f ON f.product_id = p.id
+        WHERE p.id > $1 AND p.id <= $2
+        GROUP BY p.id
+    ), repaired AS (
+        UPDATE products p
+        SET favorites_count = actual.favorites_count
+        FROM actual
+        WHERE p.id = actual.id AND p.favorites_count <> actual.favorites_count
+        RETURNING p.id
+    )
+    SELECT count(*) FROM repaired
+    """,
+)
+
+CREATE_PRODUCT = register(
+    "create_product",
+    """
+    INSERT INTO products (slug, title, brand, image, preco, review_score)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    RETURNING
+        id,
         slug,
-        email,
+        title,
+        brand,
+        image,
+        preco,
+        review_score,
+        favorites_count,
+        created_at,
+        updated_at,
+        version,
+        modified_at
+    """,
+)
+
+UPDATE_PRODUCT = register(
+    "update_product",
+    """
+    UPDATE products
+    SET slug = $1, title = $2, brand = $3, image = $4, preco = $5, review_score = $6
+    WHERE slug = $7
+    RETURNING updated_at, version, modified_at
+    """,
+)
+
+DELETE_PRODUCT = register(
+    "delete_product",
+    """
+    DELETE FROM products
+    WHERE slug = $1
+    RETURNING id
+    """,
+)
+
+
+def _products_query(where: str = "", order_by: str = "", limit: str = "") -> str:
+    # $1 is always the email of the caller (or NULL), so products with their
+    # favorites counts and the caller's favorited flag come back from a single round trip
+    if order_by:
+        order_by = f"ORDER BY {order_by}"
+
+    return f"""
+    SELECT
+        p.id,
+        p.slug,
+        p.title,
+        p.brand,
+        p.image,
+        p.preco,
+        p.review_score,
+        p.favorites_count,
+        p.created_at,
+        p.updated_at,
+        p.version,
+        p.modified_at,
+        EXISTS(
+            SELECT 1
+            FROM favorites f
+            WHERE
+                f.product_id = p.id
+                AND
+                f.client_id = (SELECT id FROM clients WHERE email = $1)
+        ) AS favorited
+    FROM products p
+    {where}
+    {order_by}
+    {limit}
+    """
+
+
+def _parse_decimal(value: str) -> Decimal:
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"Invalid decimal: {value!r}")
+
+
+class ProductsSort(NamedTuple):
+    column: str
+    attribute: str
+    descending: bool
+    parse: Callable[[str], Any]
+
+
+# every sort ends with id, so keyset pagination on (column, id) is stable and
+# each sort is served by a composite index in either direction
+PRODUCTS_SORTS = {
+    "-createdAt": ProductsSort(
+        "p.created_at", "created_at", True, datetime.fromisoformat
+    ),
+    "createdAt": ProductsSort(
+        "p.created_at", "created_at", False, datetime.fromisoformat
+    ),
+    "title": ProductsSort("p.title", "title", False, str),
+    "-title": ProductsSort("p.title", "title", True, str),
+    "preco": ProductsSort("p.preco", "preco", False, _parse_decimal),
+    "-preco": ProductsSort("p.preco", "preco", True, _parse_decimal),
+    "reviewScore": ProductsSort(
+        "p.review_score", "review_score", False, _parse_decimal
+    ),
+    "-reviewScore": ProductsSort(
+        "p.review_score", "review_score", True, _parse_decimal
+    ),
+}
+DEFAULT_PRODUCTS_SORT = "-createdAt"
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _products_page_query(
+    email: Optional[str],
+    filters: ProductFilterParams,
+    sort: str,
+    keyset: Optional[Tuple[Any, int]],
+    limit: Optional[int],
+) -> Tuple[str, List[Any]]:
+    # only the filters that are set end up in the statement, so each combination
+    # gets its own plan, see the products search indexes migration for them
+    args: List[Any] = [email]
+
+    def bind(value: Any) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    conditions = []
+    if filters.title:
+        title = bind(_escape_like(filters.title))
+        conditions.append(f"p.title ILIKE '%' || {title} || '%'")
+    if filters.brand:
+        conditions.append(f"p.brand = {bind(filters.brand)}")
+    if filters.preco_min is not None:
+        conditions.append(f"p.preco >= {bind(filters.preco_min)}")
+    if filters.preco_max is not None:
+        conditions.append(f"p.preco <= {bind(filters.preco_max)}")
+    if filters.review_score_min is not None:
+        conditions.append(f"p.review_score >= {bind(filters.review_score_min)}")
+    if filters.review_score_max is not None:
+        conditions.append(f"p.review_score <= {bind(filters.review_score_max)}")
+    if filters.favorited:
+        conditions.append(
+            f"""p.id IN (
+            SELECT f.product_id
+            FROM favorites f
+            JOIN clients c ON c.id = f.client_id
+            WHERE c.email = {bind(filters.favorited)}
+        )"""
+        )
+
+    products_sort = PRODUCTS_SORTS[sort]
+    direction = "DESC" if products_sort.descending else "ASC"
+    if keyset:
+        comparison = "<" if products_sort.descending else ">"
+        value, id = bind(keyset[0]), bind(keyset[1])
+        conditions.append(f"({products_sort.column}, p.id) {comparison} ({value}, {id})")
+
+    where = ""
+    if conditions:
+        where = "WHERE " + "\n    AND ".join(conditions)
+
+    query = _products_query(
+        where=where,
+        order_by=f"{products_sort.column} {direction}, p.id {direction}",
+        limit=f"LIMIT {bind(limit)}",
     )
+    return query, args
 
 
-async def get_favorites_count_for_product(conn: Connection, slug: str):
-    return await conn.fetchval(
-        """
-        SELECT count(*) as favorites_count
-        FROM favorites
-        WHERE product_id = (SELECT id FROM products WHERE slug = $1)
-        """,
-        slug,
+GET_PRODUCT_BY_SLUG = register(
+    "get_product_by_slug", _products_query(where="WHERE p.slug = $2")
+)
+
+
+def invalidate_cached_products(*slugs: str):
+    """
+    Must be called once the change is committed, a read that runs before the commit
+    would cache the old row again
+    """
+    for slug in slugs:
+        products_cache.pop(slug)
+
+
+@track_query_latency
+async def is_product_favorited_by_client(
+    conn: Connection, slug: str, email: str
+) -> bool:
+    return await conn.fetchval_prepared(IS_PRODUCT_FAVORITED_BY_CLIENT, email, slug)
+
+
+@track_query_latency
+async def add_product_to_favorites(conn: Connection, slug: str, email: str) -> int:
+    # the favorite row and the denormalized counter change in the same statement,
+    # the counter is only bumped when a favorite was actually inserted
+    favorites_count = await conn.fetchval_prepared(
+        ADD_PRODUCT_TO_FAVORITES, slug, email
     )
+    return favorites_count
 
-async def get_products(
-    conn: Connection
-) -> ProductInDB:
-    product_info_row = await conn.fetchrow(
-        """
-        SELECT id, slug, title, brand, image, preco, reviewScore, created_at, updated_at
-        FROM products
-        """,
+
+@track_query_latency
+async def remove_product_from_favorites(conn: Connection, slug: str, email: str) -> int:
+    favorites_count = await conn.fetchval_prepared(
+        REMOVE_PRODUCT_FROM_FAVORITES, slug, email
     )
-    if product_info_row:
-        favorites_count = await get_favorites_count_for_product(conn)
+    return favorites_count
+
+
+@track_query_latency
+async def apply_favorites_batch(
+    conn: Connection, email: str, add: List[str], remove: List[str]
+) -> List[FavoriteState]:
+    """
+    Add and remove favorites of a client with one statement, a slug present in
+    both lists ends up removed. Unknown slugs are left out of the result.
+    """
+    slugs = add + remove
+    favorited = [True] * len(add) + [False] * len(remove)
+    rows = await conn.fetch_prepared(APPLY_FAVORITES_BATCH, email, slugs, favorited)
+    return [FavoriteState(**row) for row in rows]
+
+
+@track_query_latency
+async def apply_favorite_intents(
+    conn: Connection, emails: List[str], slugs: List[str], favorited: List[bool]
+):
+    """
+    Apply queued favorite intents, the i-th intent sets whether emails[i]
+    favorited slugs[i]. Unknown clients and products are left out.
+    """
+    await conn.fetch_prepared(APPLY_FAVORITE_INTENTS, emails, slugs, favorited)
+
+
+@track_query_latency
+async def get_favorites_count_for_product(conn: Connection, slug: str) -> int:
+    return await conn.fetchval_prepared(GET_FAVORITES_COUNT_FOR_PRODUCT, slug)
 
-        return ProductInDB(
-            **product_info_row,
-            favorites_count=favorites_count,
+
+@track_query_latency
+async def reconcile_favorites_counts(
+    conn: Connection, after_id: int, batch_size: int
+) -> Tuple[Optional[int], int]:
+    """
+    Repair favorites_count drift for the next batch of products after after_id.
+    Returns the last product id of the batch (None when there is nothing left)
+    and how many counters were repaired.
+    """
+    async with conn.transaction():
+        # favorite toggles update the product row in the same statement as the
+        # favorites table, so holding the row locks makes the recount below exact
+        last_id = await conn.fetchval_prepared(
+            LOCK_PRODUCTS_BATCH, after_id, batch_size
+        )
+        if last_id is None:
+            return None, 0
+
+        repaired_count = await conn.fetchval_prepared(
+            REPAIR_FAVORITES_COUNTS, after_id, last_id
         )
 
+    return last_id, repaired_count
+
+
+@track_query_latency
+async def get_products(
+    conn: Connection,
+    limit: int,
+    filters: Optional[ProductFilterParams] = None,
+    sort: str = DEFAULT_PRODUCTS_SORT,
+    keyset: Optional[Tuple[Any, int]] = None,
+    email: Optional[str] = None,
+) -> List[ProductInDB]:
+    query, args = _products_page_query(
+        email, filters or ProductFilterParams(), sort, keyset, limit
+    )
+    rows = await conn.fetch(query, *args)
+    return [ProductInDB(**row) for row in rows]
+
+
+@track_query_latency
+async def iterate_products(
+    conn: Connection,
+    limit: Optional[int] = None,
+    filters: Optional[ProductFilterParams] = None,
+    sort: str = DEFAULT_PRODUCTS_SORT,
+    keyset: Optional[Tuple[Any, int]] = None,
+    email: Optional[str] = None,
+) -> AsyncIterator[ProductInDB]:
+    """
+    Pull products through a server-side cursor, must be called inside a transaction
+    """
+    query, args = _products_page_query(
+        email, filters or ProductFilterParams(), sort, keyset, limit
+    )
+    async for row in conn.cursor_query(query, *args):
+        yield ProductInDB(**row)
+
+
+async def _fetch_product_by_slug(
+    conn: Connection, slug: str, email: Optional[str] = None
+) -> ProductInDB:
+    row = await conn.fetchrow_prepared(GET_PRODUCT_BY_SLUG, email, slug)
+    if row:
+        return ProductInDB(**row)
+
+
+def get_cached_product(slug: str) -> Optional[ProductInDB]:
+    """
+    Copy of the cached product with favorited False, None when it is not cached
+    """
+    dbproduct = products_cache.get(slug)
+    if dbproduct is not None:
+        return dbproduct.copy()
 
+
+@track_query_latency
 async def get_product_by_slug(
-    conn: Connection, slug: str
+    conn: Connection, slug: str, email: Optional[str] = None
 ) -> ProductInDB:
-    product_info_row = await conn.fetchrow(
-        """
-        SELECT id, slug, title, brand, image, preco, reviewScore, created_at, updated_at
-        FROM products
-        WHERE slug = $1
-        """,
-        slug,
-    )
-    if product_info_row:
-        favorites_count = await get_favorites_count_for_product(conn, slug)
-        favorited_by_client = await is_product_favorited_by_client(conn, slug, email)
-
-        return ProductInDB(
-            **product_info_row,
-            client=client,
-            favorited=favorited_by_client,
-            favorites_count=favorites_count,
-        )
+    dbproduct = get_cached_product(slug)
+    if dbproduct is None:
+        dbproduct = await _fetch_product_by_slug(conn, slug, email)
+        if dbproduct:
+            products_cache.set(slug, dbproduct.copy(update={"favorited": False}))
+        return dbproduct
+
+    if email:
+        dbproduct.favorited = await is_product_favorited_by_client(conn, slug, email)
+    return dbproduct
 
 
+@track_query_latency
 async def create_product_by_slug(
-    conn: Connection, product: ProductInCreate, email: str
+    conn: Connection, product: ProductInCreate
 ) -> ProductInDB:
     slug = slugify(product.title)
 
-    row = await conn.fetchrow(
-        """
-        INSERT INTO products (slug, title, brand, image, preco, reviewScore) 
-        VALUES ($1, $2, $3, $4, $5, $6)
-        RETURNING 
-            id, 
-            title,
-            brand,
-            image,
-            preco,
-            reviewScore,
-            created_at, 
-            updated_at
-        """,
+    row = await conn.fetchrow_prepared(
+        CREATE_PRODUCT,
         slug,
         product.title,
         product.brand,
         product.image,
         product.preco,
-        product.reviewScore,
+        product.review_score,
     )
 
-    client = await get_client_by_email(conn, row["client_email"], "")
-
-    return ProductInDB(
-        **row,
-        client=client,
-        favorites_count=1,
-        favorited=True,
-    )
+    return ProductInDB(**row, favorited=False)
 
 
+@track_query_latency
 async def update_product_by_slug(
-    conn: Connection, slug: str, product: ProductInUpdate, email: str
+    conn: Connection, slug: str, product: ProductInUpdate, email: Optional[str] = None
 ) -> ProductInDB:
-    dbproduct = await get_product_by_slug(conn, slug)
+    dbproduct = await _fetch_product_by_slug(conn, slug, email)
+    if dbproduct is None:
+        return None
 
     if product.title:
         dbproduct.slug = slugify(product.title)
         dbproduct.title = product.title
-        dbproduct.brand = product.brand
-        dbproduct.image = product.image
+    dbproduct.brand = product.brand or dbproduct.brand
+    dbproduct.image = product.image or dbproduct.image
+    if product.preco is not None:
         dbproduct.preco = product.preco
-        dbproduct.reviewScore = product.reviewScore
-        
+    if product.review_score is not None:
+        dbproduct.review_score = product.review_score
 
-    row = await conn.fetchrow(
-        """
-        UPDATE products
-        SET slug = $1, title = $2, brand = $3, image = $4, preco = $5, reviewScore = $6
-        WHERE slug = $7
-        RETURNING updated_at
-        """,
+    row = await conn.fetchrow_prepared(
+        UPDATE_PRODUCT,
         dbproduct.slug,
         dbproduct.title,
         dbproduct.brand,
         dbproduct.image,
         dbproduct.preco,
-        dbproduct.reviewScore,
+        dbproduct.review_score,
         slug,
     )
 
     dbproduct.updated_at = row["updated_at"]
+    dbproduct.version = row["version"]
+    dbproduct.modified_at = row["modified_at"]
     return dbproduct
 
 
+@track_query_latency
 async def delete_product_by_slug(conn: Connection, slug: str, email: str):
-    await conn.execute(
-        """
-        DELETE FROM products 
-        WHERE slug = $1
-        """,
-        slug,
-    )
\ No newline at end of file
+    await conn.fetchval_prepared(DELETE_PRODUCT, slug)
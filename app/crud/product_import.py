@@ -0,0 +1,234 @@
+import codecs
+import csv
+import json
+import time
+from typing import AsyncIterator, Dict, List, Tuple, Union
+
+from pydantic import ValidationError
+from slugify import slugify
+
+from app.core.config import PRODUCTS_IMPORT_BATCH_SIZE, PRODUCTS_IMPORT_MAX_ERRORS
+from app.core.metrics import track_query_latency
+from app.db.connection import Connection
+from app.db.pool import InstrumentedPool
+from app.models.product import (
+    ProductImportError,
+    ProductInCreate,
+    ProductsImportResult,
+)
+
+from .product import invalidate_cached_products
+
+# line number in the source and either the parsed row or why it could not be parsed
+ImportRow = Tuple[int, Union[dict, str]]
+
+STAGING_COLUMNS = ("slug", "title", "brand", "image", "preco", "review_score")
+
+# the staging table only lives for the batch transaction, so these statements
+# are not registered for preparing on pool connections
+CREATE_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE products_import (
+        slug text,
+        title text,
+        brand text,
+        image text,
+        preco numeric(12, 2),
+        review_score numeric(5, 2)
+    ) ON COMMIT DROP
+"""
+
+MERGE_STAGING_TABLE = {
+    "skip": """
+        INSERT INTO products (slug, title, brand, image, preco, review_score)
+        SELECT slug, title, brand, image, preco, review_score
+        FROM products_import
+        ON CONFLICT (slug) DO NOTHING
+        RETURNING slug, TRUE AS inserted
+    """,
+    "update": """
+        INSERT INTO products (slug, title, brand, image, preco, review_score)
+        SELECT slug, title, brand, image, preco, review_score
+        FROM products_import
+        ON CONFLICT (slug) DO UPDATE
+        SET
+            title = EXCLUDED.title,
+            brand = EXCLUDED.brand,
+            image = EXCLUDED.image,
+            preco = EXCLUDED.preco,
+            review_score = EXCLUDED.review_score
+        RETURNING slug, (xmax = 0) AS inserted
+    """,
+}
+
+
+async def _iterate_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iterate_ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[ImportRow]:
+    line_number = 0
+    async for line in _iterate_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"Invalid JSON: {e}"
+            continue
+
+        if not isinstance(data, dict):
+            yield line_number, "Expected a JSON object"
+            continue
+
+        yield line_number, data
+
+
+async def iterate_csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[ImportRow]:
+    """
+    The first line is the header, quoted values can not span several lines
+    """
+    header = None
+    line_number = 0
+    async for line in _iterate_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+
+        try:
+            values = next(csv.reader([line]))
+        except csv.Error as e:
+            yield line_number, f"Invalid CSV: {e}"
+            continue
+
+        if header is None:
+            header = values
+        elif len(values) != len(header):
+            yield line_number, f"Expected {len(header)} values, got {len(values)}"
+        else:
+            yield line_number, dict(zip(header, values))
+
+
+def _add_error(result: ProductsImportResult, line: int, detail: str):
+    result.failed += 1
+    if len(result.errors) < PRODUCTS_IMPORT_MAX_ERRORS:
+        result.errors.append(ProductImportError(line=line, detail=detail))
+
+
+def _validation_detail(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+        for error in e.errors()
+    )
+
+
+def _parse_batch(
+    batch: List[ImportRow], on_conflict: str, result: ProductsImportResult
+) -> List[tuple]:
+    records: Dict[str, tuple] = {}
+    for line_number, data in batch:
+        if isinstance(data, str):
+            _add_error(result, line_number, data)
+            continue
+
+        try:
+            product = ProductInCreate(**data)
+        except ValidationError as e:
+            _add_error(result, line_number, _validation_detail(e))
+            continue
+
+        slug = slugify(product.title)
+        if not slug:
+            _add_error(result, line_number, "title: can not be turned into a slug")
+            continue
+
+        # a slug repeated inside the import behaves like a conflict with the table:
+        # the first row is kept when skipping and the last one wins when updating
+        if slug in records:
+            result.skipped += 1
+            if on_conflict == "skip":
+                continue
+
+        records[slug] = (
+            slug,
+            product.title,
+            product.brand,
+            product.image,
+            product.preco,
+            product.review_score,
+        )
+
+    return list(records.values())
+
+
+@track_query_latency
+async def merge_products_batch(
+    conn: Connection,
+    records: List[tuple],
+    on_conflict: str,
+    result: ProductsImportResult,
+):
+    async with conn.transaction():
+        await conn.execute(CREATE_STAGING_TABLE)
+        await conn.copy_records_to_table(
+            "products_import", records=records, columns=STAGING_COLUMNS
+        )
+        merged = await conn.fetch(MERGE_STAGING_TABLE[on_conflict])
+
+    for row in merged:
+        if row["inserted"]:
+            result.inserted += 1
+        else:
+            result.updated += 1
+            invalidate_cached_products(row["slug"])
+
+    result.skipped += len(records) - len(merged)
+
+
+async def import_products(
+    pool: InstrumentedPool,
+    rows: AsyncIterator[ImportRow],
+    on_conflict: str = "skip",
+    batch_size: int = PRODUCTS_IMPORT_BATCH_SIZE,
+) -> ProductsImportResult:
+    """
+    Load products in batches through a COPY into a staging table merged into products.
+    on_conflict is "skip" to keep existing products or "update" to overwrite them.
+    A pool connection is only held while a parsed batch is written, not while
+    the rows are read, so a slow upload does not pin one.
+    """
+    result = ProductsImportResult()
+    started_at = time.perf_counter()
+    rows_count = 0
+
+    async def write(batch: List[ImportRow]):
+        records = _parse_batch(batch, on_conflict, result)
+        if records:
+            async with pool.acquire() as conn:
+                await merge_products_batch(conn, records, on_conflict, result)
+
+    batch: List[ImportRow] = []
+    async for row in rows:
+        rows_count += 1
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await write(batch)
+            batch = []
+
+    if batch:
+        await write(batch)
+
+    elapsed = time.perf_counter() - started_at
+    result.rows_per_second = rows_count / elapsed if elapsed else 0
+    return result
@@ -1,6 +1,5 @@
 from typing import Optional
 
-from asyncpg import Connection
 from pydantic import EmailStr
 from starlette.exceptions import HTTPException
 from starlette.status import (
@@ -9,24 +8,28 @@ from starlette.status import (
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
+from app.core.metrics import track_query_latency
+from app.db.connection import Connection
 from app.models.product import ProductInDB
 
 from .product import get_product_by_slug
 from .client import get_client, get_client_by_email
 
 
+@track_query_latency
 async def check_free_email(
     conn: Connection, email: Optional[EmailStr] = None
 ):
     if email:
-        user_by_email = await get_user_by_email(conn, email)
-        if user_by_email:
+        client_by_email = await get_client_by_email(conn, email)
+        if client_by_email:
             raise HTTPException(
                 status_code=HTTP_422_UNPROCESSABLE_ENTITY,
                 detail="Client with this email already exists",
             )
 
 
+@track_query_latency
 async def get_product_or_404(
     conn: Connection, slug: str, email: Optional[str] = None
 ) -> ProductInDB:
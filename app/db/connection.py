@@ -0,0 +1,158 @@
+import itertools
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, List
+
+import asyncpg
+from asyncpg import Record
+
+from .statements import get_query
+from .tracing import fingerprint, record_query, row_count
+
+# rows fetched per round trip by the cursors of a transaction-mode pooler,
+# asyncpg's own cursors prefetch as many
+CURSOR_PREFETCH = 50
+
+_cursor_ids = itertools.count()
+
+
+class Connection(asyncpg.Connection):
+    """
+    Pool connection that runs registered statements through the asyncpg statement
+    cache and records every statement in the query trace of the current request
+    """
+
+    async def _traced(self, query_fingerprint: str, result: Awaitable) -> Any:
+        started = time.perf_counter()
+        rows = 0
+        try:
+            value = await result
+            rows = row_count(value)
+            return value
+        finally:
+            record_query(query_fingerprint, time.perf_counter() - started, rows)
+
+    async def execute(self, query: str, *args: Any, timeout: float = None) -> str:
+        return await self._traced(
+            fingerprint(query), super().execute(query, *args, timeout=timeout)
+        )
+
+    async def fetch(
+        self, query: str, *args: Any, timeout: float = None
+    ) -> List[Record]:
+        return await self._traced(
+            fingerprint(query), super().fetch(query, *args, timeout=timeout)
+        )
+
+    async def fetchrow(self, query: str, *args: Any, timeout: float = None) -> Record:
+        return await self._traced(
+            fingerprint(query), super().fetchrow(query, *args, timeout=timeout)
+        )
+
+    async def fetchval(
+        self, query: str, *args: Any, column: int = 0, timeout: float = None
+    ) -> Any:
+        return await self._traced(
+            fingerprint(query),
+            super().fetchval(query, *args, column=column, timeout=timeout),
+        )
+
+    async def copy_records_to_table(self, table_name: str, **kwargs: Any) -> str:
+        return await self._traced(
+            f"COPY {table_name}", super().copy_records_to_table(table_name, **kwargs)
+        )
+
+    async def cursor_query(self, query: str, *args: Any) -> AsyncIterator[Record]:
+        """
+        Iterate over a server-side cursor, must be called inside a transaction
+        """
+        cursor = self.cursor(query, *args)
+        async for record in self._traced_cursor(fingerprint(query), cursor):
+            yield record
+
+    async def _traced_cursor(
+        self, query_fingerprint: str, cursor: Any
+    ) -> AsyncIterator[Record]:
+        # the rows are fetched in batches while the caller consumes them,
+        # so only the time spent waiting on the database is recorded
+        duration = 0.0
+        rows = 0
+        iterator = cursor.__aiter__()
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    record = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    duration += time.perf_counter() - started
+                rows += 1
+                yield record
+        finally:
+            record_query(query_fingerprint, duration, rows)
+
+    async def _run_prepared(self, method: str, name: str, args: tuple) -> Any:
+        # the statement cache keeps the statement prepared across pool checkouts,
+        # and prepares it again when a migration changed its result type outside a
+        # transaction. The fingerprinting overrides are skipped, the trace keeps the name
+        query = getattr(super(), method)(get_query(name), *args)
+        return await self._traced(name, query)
+
+    async def fetch_prepared(self, name: str, *args: Any) -> List[Record]:
+        return await self._run_prepared("fetch", name, args)
+
+    async def fetchrow_prepared(self, name: str, *args: Any) -> Record:
+        return await self._run_prepared("fetchrow", name, args)
+
+    async def fetchval_prepared(self, name: str, *args: Any) -> Any:
+        return await self._run_prepared("fetchval", name, args)
+
+    async def cursor_prepared(self, name: str, *args: Any) -> AsyncIterator[Record]:
+        """
+        Iterate over a server-side cursor, must be called inside a transaction
+        """
+        cursor = self.cursor(get_query(name), *args)
+        async for record in self._traced_cursor(name, cursor):
+            yield record
+
+
+class UnpreparedConnection(Connection):
+    """
+    Connection for a transaction-mode pooler, opened without a statement cache so
+    statements run unnamed, since a named statement only exists on the server
+    connection that prepared it
+    """
+
+    async def cursor_query(self, query: str, *args: Any) -> AsyncIterator[Record]:
+        cursor = self._declared_cursor(query, args)
+        async for record in self._traced_cursor(fingerprint(query), cursor):
+            yield record
+
+    async def cursor_prepared(self, name: str, *args: Any) -> AsyncIterator[Record]:
+        cursor = self._declared_cursor(get_query(name), args)
+        async for record in self._traced_cursor(name, cursor):
+            yield record
+
+    async def _declared_cursor(self, query: str, args: tuple) -> AsyncIterator[Record]:
+        # asyncpg cursors always prepare a named statement, which outlives the
+        # transaction on the server connection, DECLARE and FETCH are unnamed ones.
+        # the cursor is closed with the transaction
+        name = f"cursor_{next(_cursor_ids)}"
+        connection = super(Connection, self)
+        await connection.execute(f"DECLARE {name} NO SCROLL CURSOR FOR {query}", *args)
+        while True:
+            records = await connection.fetch(f"FETCH {CURSOR_PREFETCH} FROM {name}")
+            for record in records:
+                yield record
+            if len(records) < CURSOR_PREFETCH:
+                break
+
+
+async def init_connection(conn: Connection):
+    await conn.set_type_codec(
+        "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+    )
+    await conn.set_type_codec(
+        "jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+    )
@@ -1,8 +1,51 @@
-from asyncpg.pool import Pool
+import itertools
+from typing import List, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import (
+    READ_YOUR_WRITES_CACHE_SIZE,
+    READ_YOUR_WRITES_SECONDS,
+    REPLICA_MAX_LAG_SECONDS,
+)
+
+from .pool import InstrumentedPool
 
 
 class DataBase:
-    pool: Pool = None
+    pool: InstrumentedPool = None
+
+    def __init__(self):
+        self.replica_pools: List[InstrumentedPool] = []
+        # seconds each replica is behind the primary, None until it is measured
+        # or while the replica can not be reached
+        self.replica_lags: List[Optional[float]] = []
+        # clients that wrote recently read from the primary, so they see their own writes
+        self.recent_writers = TTLCache(
+            maxsize=READ_YOUR_WRITES_CACHE_SIZE, ttl=READ_YOUR_WRITES_SECONDS
+        )
+        self._replica_counter = itertools.count()
+
+    def mark_written(self, *keys: str):
+        for key in keys:
+            self.recent_writers.set(key, True)
+
+    def read_pool(self, key: Optional[str] = None) -> InstrumentedPool:
+        """
+        Pool for a read only request, key identifies the client that reads,
+        anonymous reads pass None
+        """
+        if key is not None and self.recent_writers.get(key, False):
+            return self.pool
+
+        replicas = [
+            pool
+            for pool, lag in zip(self.replica_pools, self.replica_lags)
+            if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        ]
+        if not replicas:
+            return self.pool
+
+        return replicas[next(self._replica_counter) % len(replicas)]
 
 
 db = DataBase()
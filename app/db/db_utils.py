@@ -1,27 +1,217 @@
+import asyncio
 import logging
+import random
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
 
 import asyncpg
 
-from app.core.config import DATABASE_URL, MAX_CONNECTIONS_COUNT, MIN_CONNECTIONS_COUNT
+from app.core.config import (
+    DATABASE_REPLICA_URLS,
+    DATABASE_URL,
+    DB_IDLE_IN_TRANSACTION_TIMEOUT_MS,
+    DB_POOLER_MODE,
+    DB_POOLER_PREPARED_STATEMENTS,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_ADAPT_INTERVAL,
+    DB_POOL_ADAPTIVE,
+    DB_POOL_LAZY,
+    DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+    DB_POOL_TARGET_WAIT_MS,
+    DB_POOL_WARMUP_STAGGER,
+    DB_STATEMENT_TIMEOUT_MS,
+    FAVORITES_WRITE_BEHIND,
+    MAX_CONNECTIONS_COUNT,
+    MIN_CONNECTIONS_COUNT,
+    PROJECT_NAME,
+    REPLICA_LAG_CHECK_INTERVAL,
+    STATEMENT_CACHE_SIZE,
+)
 
+from app.core.startup import startup_phase
+from app.crud.favorites_buffer import favorites_buffer
+
+from .connection import Connection, UnpreparedConnection, init_connection
 from .database import db
+from .pool import AdaptiveLimiter, InstrumentedPool
 
+# sent as startup parameters, so they stay the session defaults after the pool
+# runs RESET ALL on released connections
+SERVER_SETTINGS = {
+    "application_name": PROJECT_NAME,
+    "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+    "idle_in_transaction_session_timeout": str(DB_IDLE_IN_TRANSACTION_TIMEOUT_MS),
+}
 
-async def connect_to_postgres():
-    logging.info("Connecting to database")
+# WAL positions as byte offsets. A replica is as far behind as the time since the
+# primary first wrote WAL the replica has not replayed yet, so a replica whose
+# replication broke falls behind as soon as the primary writes, while an idle
+# primary does not make a healthy replica look late
+PRIMARY_WAL_POSITION_QUERY = "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')"
+REPLICA_WAL_POSITION_QUERY = """
+    SELECT
+        pg_is_in_recovery() AS in_recovery,
+        pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0') AS replayed
+"""
+# primary positions kept to measure lag, past the window a replica is just "late"
+REPLICA_LAG_WINDOW_SECONDS = 60
+
+if DB_POOLER_MODE not in ("", "session", "transaction"):
+    raise ValueError(f"Unknown DB_POOLER_MODE '{DB_POOLER_MODE}'")
+
+# a transaction-mode pooler may run each transaction on another server connection,
+# so nothing can outlive a transaction there: named prepared statements, unless the
+# pooler tracks them itself, and session settings, which it rejects as startup
+# parameters and should be set on the database role instead
+TRANSACTION_POOLER = DB_POOLER_MODE == "transaction"
+PREPARED_STATEMENTS = not TRANSACTION_POOLER or DB_POOLER_PREPARED_STATEMENTS
 
-    db.pool = await asyncpg.create_pool(
-        str(DATABASE_URL),
-        min_size=MIN_CONNECTIONS_COUNT,
+if TRANSACTION_POOLER:
+    SERVER_SETTINGS = {"application_name": PROJECT_NAME}
+
+# replica lag monitors, pool warm-ups and the favorites flusher,
+# cancelled when the connection is closed
+_background_tasks = []
+
+
+async def _create_pool(dsn: str, name: str) -> InstrumentedPool:
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=0 if DB_POOL_LAZY else MIN_CONNECTIONS_COUNT,
         max_size=MAX_CONNECTIONS_COUNT,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+        connection_class=Connection if PREPARED_STATEMENTS else UnpreparedConnection,
+        init=init_connection,
+        # without a cache asyncpg only uses the unnamed statement
+        statement_cache_size=STATEMENT_CACHE_SIZE if PREPARED_STATEMENTS else 0,
+        server_settings=SERVER_SETTINGS,
+    )
+
+    limiter = None
+    if DB_POOL_ADAPTIVE:
+        limiter = AdaptiveLimiter(
+            MIN_CONNECTIONS_COUNT,
+            MAX_CONNECTIONS_COUNT,
+            target_wait=DB_POOL_TARGET_WAIT_MS / 1000,
+            interval=DB_POOL_ADAPT_INTERVAL,
+        )
+
+    return InstrumentedPool(
+        pool, name, acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT or None, limiter=limiter
     )
 
+
+def _replica_lag(
+    samples: Deque[Tuple[float, int]], in_recovery: bool, replayed: Optional[int]
+) -> Optional[float]:
+    if not in_recovery:
+        return 0.0
+    if replayed is None:
+        return None
+
+    now = time.monotonic()
+    for sampled_at, position in samples:
+        if position > replayed:
+            return now - sampled_at
+    return 0.0
+
+
+async def _monitor_replica_lag(index: int):
+    pool = db.replica_pools[index]
+    # (monotonic time, primary WAL position) of every check, oldest first
+    samples: Deque[Tuple[float, int]] = deque(
+        maxlen=int(REPLICA_LAG_WINDOW_SECONDS / REPLICA_LAG_CHECK_INTERVAL) + 1
+    )
+    while True:
+        try:
+            async with db.pool.acquire(timeout=REPLICA_LAG_CHECK_INTERVAL) as conn:
+                position = await conn.fetchval(
+                    PRIMARY_WAL_POSITION_QUERY, timeout=REPLICA_LAG_CHECK_INTERVAL
+                )
+            samples.append((time.monotonic(), int(position)))
+
+            async with pool.acquire(timeout=REPLICA_LAG_CHECK_INTERVAL) as conn:
+                row = await conn.fetchrow(
+                    REPLICA_WAL_POSITION_QUERY, timeout=REPLICA_LAG_CHECK_INTERVAL
+                )
+            replayed = int(row["replayed"]) if row["replayed"] is not None else None
+            lag = _replica_lag(samples, row["in_recovery"], replayed)
+            if lag is None and db.replica_lags[index] is not None:
+                logging.warning(f"Replica {index} has not replayed any WAL")
+            db.replica_lags[index] = lag
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # any failure leaves the replica out of reads until a check succeeds,
+            # the monitor itself keeps running
+            if db.replica_lags[index] is not None:
+                logging.warning(f"Replica {index} is unavailable for reads: {e!r}")
+            db.replica_lags[index] = None
+
+        await asyncio.sleep(REPLICA_LAG_CHECK_INTERVAL)
+
+
+async def _top_up_pool(pool: InstrumentedPool):
+    try:
+        await pool.top_up(MIN_CONNECTIONS_COUNT)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        # requests open the missing connections themselves
+        logging.warning(f"Warming up the {pool.name} pool failed: {e!r}")
+
+
+async def _keep_pool_warm(pool: InstrumentedPool):
+    if DB_POOL_LAZY:
+        await asyncio.sleep(random.uniform(0, DB_POOL_WARMUP_STAGGER))
+        with startup_phase(f"warm_up_{pool.name}_pool"):
+            await _top_up_pool(pool)
+
+    if not DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME:
+        return
+    # asyncpg closes a connection idle for its inactive lifetime whatever the pool
+    # min_size, the ones closed while requests did not need them are opened again
+    while True:
+        await asyncio.sleep(DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME / 2)
+        await _top_up_pool(pool)
+
+
+async def connect_to_postgres():
+    logging.info("Connecting to database")
+
+    with startup_phase("connect_to_postgres"):
+        db.pool = await _create_pool(str(DATABASE_URL), "primary")
+        for index, url in enumerate(DATABASE_REPLICA_URLS):
+            db.replica_pools.append(await _create_pool(str(url), f"replica-{index}"))
+            db.replica_lags.append(None)
+
+    for index in range(len(db.replica_pools)):
+        _background_tasks.append(asyncio.ensure_future(_monitor_replica_lag(index)))
+
+    for pool in [db.pool, *db.replica_pools]:
+        _background_tasks.append(asyncio.ensure_future(_keep_pool_warm(pool)))
+
+    if FAVORITES_WRITE_BEHIND:
+        _background_tasks.append(favorites_buffer.start())
+
     logging.info("Connected to database")
 
 
 async def close_postgres_connection():
     logging.info("Closing connection")
 
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+    # what is still queued is written before the pools go away
+    await favorites_buffer.flush()
+
+    for pool in db.replica_pools:
+        await pool.close()
+    db.replica_pools.clear()
+    db.replica_lags.clear()
+
     await db.pool.close()
 
     logging.info("Connection closed")
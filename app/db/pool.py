@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from asyncpg.pool import Pool
+
+from app.core.metrics import (
+    DB_POOL_ACQUIRE_SECONDS,
+    DB_POOL_ACQUIRE_TIMEOUTS,
+    DB_POOL_CONNECTIONS_IDLE,
+    DB_POOL_CONNECTIONS_IN_USE,
+    DB_POOL_LIMIT,
+)
+
+from .connection import Connection
+
+
+class PoolAcquireTimeoutError(asyncio.TimeoutError):
+    pass
+
+
+class AdaptiveLimiter:
+    """
+    Bounds how many connections handlers hold at once between min_limit and max_limit.
+    Once per interval the limit grows by one when the average acquire wait was above
+    target_wait, or shrinks by one when the interval never needed all of it. The pool
+    closes the connections left idle by a lower limit after their inactive lifetime.
+    """
+
+    def __init__(
+        self, min_limit: int, max_limit: int, target_wait: float, interval: float
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min_limit
+        self.target_wait = target_wait
+        self.interval = interval
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._interval_started = time.monotonic()
+        self._interval_waits = 0.0
+        self._interval_acquires = 0
+        self._interval_peak = 0
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self._take()
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # the permit was handed over right before the waiter was cancelled
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def record_wait(self, wait: float):
+        self._interval_waits += wait
+        self._interval_acquires += 1
+
+        now = time.monotonic()
+        if now - self._interval_started < self.interval:
+            return
+
+        average_wait = self._interval_waits / self._interval_acquires
+        if average_wait > self.target_wait and self.limit < self.max_limit:
+            self.limit += 1
+            self._wake()
+        elif self._interval_peak < self.limit and self.limit > self.min_limit:
+            self.limit -= 1
+
+        self._interval_started = now
+        self._interval_waits = 0.0
+        self._interval_acquires = 0
+        self._interval_peak = self.active
+
+    def _take(self):
+        self.active += 1
+        self._interval_peak = max(self._interval_peak, self.active)
+
+    def _wake(self):
+        while self._waiters and self.active < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._take()
+                waiter.set_result(None)
+
+
+class _PoolAcquireContext:
+    def __init__(self, pool: "InstrumentedPool", timeout: Optional[float]):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def __aenter__(self) -> Connection:
+        self.conn = await self.pool._acquire(self.timeout)
+        return self.conn
+
+    async def __aexit__(self, *exc_info):
+        await self.pool._release(self.conn)
+
+
+class InstrumentedPool:
+    """
+    asyncpg pool that records acquire waits, timeouts and connection usage,
+    optionally behind an AdaptiveLimiter
+    """
+
+    def __init__(
+        self,
+        pool: Pool,
+        name: str,
+        acquire_timeout: Optional[float] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ):
+        self.name = name
+        self.acquire_timeout = acquire_timeout
+        self.limiter = limiter
+        self.in_use = 0
+        self._pool = pool
+
+        self._acquire_seconds = DB_POOL_ACQUIRE_SECONDS.labels(pool=name)
+        self._acquire_timeouts = DB_POOL_ACQUIRE_TIMEOUTS.labels(pool=name)
+        self._in_use_gauge = DB_POOL_CONNECTIONS_IN_USE.labels(pool=name)
+        self._idle_gauge = DB_POOL_CONNECTIONS_IDLE.labels(pool=name)
+        self._limit_gauge = DB_POOL_LIMIT.labels(pool=name)
+        self._update_gauges()
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _PoolAcquireContext:
+        return _PoolAcquireContext(self, timeout or self.acquire_timeout)
+
+    async def close(self):
+        await self._pool.close()
+
+    @property
+    def size(self) -> int:
+        # asyncpg has no public size getter in the pinned version,
+        # holders with a connection are the open ones
+        return sum(1 for holder in self._pool._holders if holder._con is not None)
+
+    async def top_up(self, size: int):
+        """
+        Open the connections missing for size of them to be open. Nothing is taken
+        while enough are open, otherwise connections are taken one after the other,
+        opening the closed ones, as long as one more is left for handlers and none
+        waits for a permit of the limiter. They are held until the last one is opened.
+        """
+        connections = []
+        try:
+            while (
+                self.size < size
+                and self.in_use + len(connections) < self._pool._maxsize - 1
+                and not (self.limiter and self.limiter.waiting)
+            ):
+                connections.append(await self._pool.acquire())
+        finally:
+            for conn in connections:
+                await self._pool.release(conn)
+            self._update_gauges()
+
+    async def _acquire(self, timeout: Optional[float]) -> Connection:
+        started = time.monotonic()
+        try:
+            if self.limiter:
+                await asyncio.wait_for(self.limiter.acquire(), timeout)
+                if timeout is not None:
+                    timeout = max(timeout - (time.monotonic() - started), 0)
+
+            try:
+                conn = await self._pool.acquire(timeout=timeout)
+            except BaseException:
+                if self.limiter:
+                    self.limiter.release()
+                raise
+        except asyncio.TimeoutError:
+            self._acquire_timeouts.inc()
+            raise PoolAcquireTimeoutError(
+                f"No connection of the {self.name} pool became available in time"
+            )
+
+        wait = time.monotonic() - started
+        self._acquire_seconds.observe(wait)
+        if self.limiter:
+            self.limiter.record_wait(wait)
+
+        self.in_use += 1
+        self._update_gauges()
+        return conn
+
+    async def _release(self, conn: Connection):
+        try:
+            await self._pool.release(conn)
+        finally:
+            self.in_use -= 1
+            if self.limiter:
+                self.limiter.release()
+            self._update_gauges()
+
+    def _update_gauges(self):
+        self._in_use_gauge.set(self.in_use)
+        self._idle_gauge.set(max(self.size - self.in_use, 0))
+        if self.limiter:
+            self._limit_gauge.set(self.limiter.limit)
+        else:
+            self._limit_gauge.set(self._pool._maxsize)
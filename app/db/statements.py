@@ -0,0 +1,22 @@
+from typing import Dict
+
+_statements: Dict[str, str] = {}
+
+
+def register(name: str, query: str) -> str:
+    """
+    Register a statement to run prepared on every pool connection, returns its name
+    """
+    if _statements.get(name, query) != query:
+        raise ValueError(f"Statement '{name}' is already registered with another query")
+
+    _statements[name] = query
+    return name
+
+
+def get_query(name: str) -> str:
+    return _statements[name]
+
+
+def registered_statements() -> Dict[str, str]:
+    return dict(_statements)
@@ -0,0 +1,76 @@
+import functools
+import logging
+import re
+from contextvars import ContextVar
+from typing import Any, List, NamedTuple, Optional
+
+from app.core.config import SLOW_QUERY_THRESHOLD_MS
+
+
+class QueryRecord(NamedTuple):
+    fingerprint: str
+    duration: float
+    rows: int
+
+
+class QueryTrace:
+    """
+    Statements run on behalf of one request, shared by the tasks it spawns
+    """
+
+    def __init__(self):
+        self.queries: List[QueryRecord] = []
+
+    @property
+    def duration(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.duration * 1000:.1f};desc="{len(self.queries)} queries"'
+        )
+
+
+_current_trace: ContextVar[Optional[QueryTrace]] = ContextVar(
+    "current_query_trace", default=None
+)
+
+_LITERALS_RE = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """
+    Statement text with literals replaced and whitespace collapsed,
+    so calls that only differ in values share a fingerprint
+    """
+    query = _LITERALS_RE.sub("?", query)
+    return _WHITESPACE_RE.sub(" ", query).strip()[:200]
+
+
+def row_count(result: Any) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        # command status of execute and copy, e.g. "UPDATE 3" or "COPY 5000"
+        count = result.rsplit(" ", 1)[-1]
+        return int(count) if count.isdigit() else 0
+    return int(result is not None)
+
+
+def start_trace() -> QueryTrace:
+    trace = QueryTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+def record_query(fingerprint: str, duration: float, rows: int):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.queries.append(QueryRecord(fingerprint, duration, rows))
+
+    if SLOW_QUERY_THRESHOLD_MS and duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        logging.warning(
+            f"Slow query ({duration * 1000:.1f} ms, {rows} rows): {fingerprint}"
+        )
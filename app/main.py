@@ -3,28 +3,65 @@ from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
-from app.api.api_v1.api import router as api_router
-from app.core.config import ALLOWED_HOSTS, API_V1_STR, PROJECT_NAME
-from app.core.errors import http_422_error_handler, http_error_handler
+from app.core.config import ALLOWED_HOSTS, API_V1_STR, PROJECT_NAME, QUERY_TRACING
+from app.core.errors import (
+    http_422_error_handler,
+    http_error_handler,
+    pool_acquire_timeout_error_handler,
+)
+from app.core.metrics import METRICS_ENABLED, metrics_endpoint
+from app.core.middleware import MetricsMiddleware, QueryTracingMiddleware
+from app.core.security import load_password_hashing_backend
+from app.core.startup import startup_phase
 from app.db.db_utils import close_postgres_connection, connect_to_postgres
+from app.db.pool import PoolAcquireTimeoutError
 
-app = FastAPI(title=PROJECT_NAME)
 
-if not ALLOWED_HOSTS:
-    ALLOWED_HOSTS = ["*"]
+def create_app() -> FastAPI:
+    """
+    Everything done here happens once in the gunicorn master when the app is
+    preloaded, workers only open their database pools after the fork
+    """
+    with startup_phase("imports"):
+        # endpoints pull in the models, crud and passlib
+        from app.api.api_v1.api import router as api_router
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_HOSTS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    with startup_phase("create_app"):
+        app = FastAPI(title=PROJECT_NAME)
+
+        app.add_middleware(
+            CORSMiddleware,
+            allow_origins=ALLOWED_HOSTS or ["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+
+        if QUERY_TRACING:
+            app.add_middleware(QueryTracingMiddleware)
+
+        if METRICS_ENABLED:
+            app.add_middleware(MetricsMiddleware)
+            app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+        app.add_event_handler("startup", connect_to_postgres)
+        app.add_event_handler("shutdown", close_postgres_connection)
+
+        app.add_exception_handler(HTTPException, http_error_handler)
+        app.add_exception_handler(HTTP_422_UNPROCESSABLE_ENTITY, http_422_error_handler)
+        app.add_exception_handler(
+            PoolAcquireTimeoutError, pool_acquire_timeout_error_handler
+        )
+
+        app.include_router(api_router, prefix=API_V1_STR)
+
+    with startup_phase("openapi"):
+        app.openapi()
+
+    with startup_phase("password_hashing_backend"):
+        load_password_hashing_backend()
 
-app.add_event_handler("startup", connect_to_postgres)
-app.add_event_handler("shutdown", close_postgres_connection)
+    return app
 
-app.add_exception_handler(HTTPException, http_error_handler)
-app.add_exception_handler(HTTP_422_UNPROCESSABLE_ENTITY, http_422_error_handler)
 
-app.include_router(api_router, prefix=API_V1_STR)
+app = create_app()
@@ -2,7 +2,7 @@ from typing import Optional
 
 from pydantic import EmailStr, UrlStr
 
-from app.core.security import generate_salt, get_password_hash, verify_password
+from app.core.security import hash_password, password_needs_rehash, verify_password
 
 from .dbmodel import DBModelMixin
 from .rwmodel import RWModel
@@ -17,12 +17,14 @@ class ClientInDB(DBModelMixin, ClientBase):
     salt: str = ""
     hashed_password: str = ""
 
-    def check_password(self, password: str):
-        return verify_password(self.salt + password, self.hashed_password)
+    async def check_password(self, password: str):
+        return await verify_password(self.salt + password, self.hashed_password)
 
-    def change_password(self, password: str):
-        self.salt = generate_salt()
-        self.hashed_password = get_password_hash(self.salt + password)
+    async def change_password(self, password: str):
+        self.salt, self.hashed_password = await hash_password(password)
+
+    def password_needs_rehash(self):
+        return password_needs_rehash(self.hashed_password)
 
 
 class Client(ClientBase):
@@ -3,7 +3,7 @@ from typing import List, Optional
 from pydantic import Schema
 
 from .dbmodel import DateTimeModelMixin, DBModelMixin
-from .client import Client
+from .client import ClientBase
 from .product import Product
 from .rwmodel import RWModel
 
@@ -16,7 +16,7 @@ class FavoriteBase(RWModel):
     pass
 
 class Favorite(DateTimeModelMixin, FavoriteBase):
-    client: Client
+    client: ClientBase
     product: Product
 
 class FavoriteInDB(DBModelMixin, Favorite):
@@ -29,6 +29,23 @@ class FavoriteInResponse(RWModel):
 
 class ManyFavoritesInResponse(RWModel):
     favorites: List[Favorite]
+    favorites_count: int = Schema(..., alias="favoritesCount")
+    next_cursor: Optional[str] = Schema(None, alias="nextCursor")
 
 class FavoriteInCreate(FavoriteBase):
     pass
+
+
+class FavoritesInBatchUpdate(RWModel):
+    add: List[str] = []
+    remove: List[str] = []
+
+
+class FavoriteState(RWModel):
+    slug: str
+    favorited: bool
+    favorites_count: int = Schema(..., alias="favoritesCount")
+
+
+class ManyFavoriteStatesInResponse(RWModel):
+    favorites: List[FavoriteState]
@@ -1,17 +1,25 @@
-from typing import List, Optional
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Optional
 
-from pydantic import Schema
+from pydantic import Schema, condecimal
 
 from .dbmodel import DateTimeModelMixin, DBModelMixin
 from .rwmodel import RWModel
 
 
+# match the numeric(12, 2) and numeric(5, 2) columns, so out of range values are a 422
+Preco = condecimal(ge=0, max_digits=12, decimal_places=2)
+ReviewScore = condecimal(ge=0, max_digits=5, decimal_places=2)
+
+
 class ProductFilterParams(RWModel):
     title: str = ""
     brand: str = ""
-    image: str = ""
-    preco: str = ""
-    reviewScore: str = ""
+    preco_min: Optional[Decimal] = Schema(None, alias="precoMin")
+    preco_max: Optional[Decimal] = Schema(None, alias="precoMax")
+    review_score_min: Optional[Decimal] = Schema(None, alias="reviewScoreMin")
+    review_score_max: Optional[Decimal] = Schema(None, alias="reviewScoreMax")
     favorited: str = ""
 
 
@@ -19,9 +27,8 @@ class ProductBase(RWModel):
     title: str
     brand: str
     image: str
-    preco: str
-    reviewScore: str
-    favorited: str
+    preco: Preco
+    review_score: ReviewScore = Schema(..., alias="reviewScore")
 
 
 class Product(DateTimeModelMixin, ProductBase):
@@ -29,9 +36,19 @@ class Product(DateTimeModelMixin, ProductBase):
     favorited: bool
     favorites_count: int = Schema(..., alias="favoritesCount")
 
+    @classmethod
+    def validate(cls, value: Any) -> "Product":
+        # responses are built from a ProductInDB, its id and version columns stay out
+        if isinstance(value, cls) and type(value) is not cls:
+            values = {name: getattr(value, name) for name in cls.__fields__}
+            return cls.construct(values, set(values))
+        return super().validate(value)
+
 
 class ProductInDB(DBModelMixin, Product):
-    pass
+    # bumped by every update of the row, favorites_count included, unlike updated_at
+    version: int = 1
+    modified_at: Optional[datetime] = Schema(None, alias="modifiedAt")
 
 
 class ProductInResponse(RWModel):
@@ -40,7 +57,8 @@ class ProductInResponse(RWModel):
 
 class ManyProductsInResponse(RWModel):
     products: List[Product]
-    favorites_count: int = Schema(..., alias="favoritesCount")
+    products_count: int = Schema(..., alias="productsCount")
+    next_cursor: Optional[str] = Schema(None, alias="nextCursor")
 
 
 class ProductInCreate(ProductBase):
@@ -51,5 +69,23 @@ class ProductInUpdate(RWModel):
     title: Optional[str] = None
     brand: Optional[str] = None
     image: Optional[str] = None
-    preco: Optional[str] = None
-    reviewScore: Optional[str] = None
+    preco: Optional[Preco] = None
+    review_score: Optional[ReviewScore] = Schema(None, alias="reviewScore")
+
+
+class ProductImportError(RWModel):
+    line: int
+    detail: str
+
+
+class ProductsImportResult(RWModel):
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    errors: List[ProductImportError] = []
+    rows_per_second: float = Schema(0, alias="rowsPerSecond")
+
+
+class ProductsImportInResponse(RWModel):
+    result: ProductsImportResult
@@ -1,4 +1,5 @@
 from datetime import datetime, timezone
+from decimal import Decimal
 
 from pydantic import BaseConfig, BaseModel
 
@@ -9,5 +10,7 @@ class RWModel(BaseModel):
         json_encoders = {
             datetime: lambda dt: dt.replace(tzinfo=timezone.utc)
             .isoformat()
-            .replace("+00:00", "Z")
+            .replace("+00:00", "Z"),
+            # keeps preco and reviewScore strings, as they were when stored as text
+            Decimal: str,
         }
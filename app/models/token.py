@@ -2,4 +2,4 @@ from .rwmodel import RWModel
 
 
 class TokenPayload(RWModel):
-    username: str = ""
+    email: str = ""
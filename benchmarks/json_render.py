@@ -0,0 +1,63 @@
+"""
+Cost of rendering a products list response with jsonable_encoder and JSONResponse
+and with the one-pass AliasedModelResponse, checking the bodies are byte-identical.
+
+    python -m benchmarks.json_render
+    JSON_BACKEND=orjson python -m benchmarks.json_render
+"""
+import timeit
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from app.core.config import JSON_BACKEND
+from app.core.utils import create_aliased_response
+from app.models.product import ManyProductsInResponse, ProductInDB
+
+
+def make_response_model(products_count: int) -> ManyProductsInResponse:
+    now = datetime.utcnow()
+    products = [
+        ProductInDB(
+            id=i,
+            slug=f"product-{i}",
+            title=f"Product {i}",
+            brand="Brand",
+            image=f"https://example.com/images/{i}.png",
+            preco="19.90",
+            reviewScore="4.5",
+            favorited=bool(i % 2),
+            favorites_count=i,
+            created_at=now - timedelta(minutes=i),
+            updated_at=now,
+        )
+        for i in range(products_count)
+    ]
+    return ManyProductsInResponse(
+        products=products, products_count=products_count, next_cursor="cursor"
+    )
+
+
+def main(products_count: int = 100, number: int = 200):
+    model = make_response_model(products_count)
+
+    def render_jsonable_encoder():
+        return JSONResponse(content=jsonable_encoder(model, by_alias=True)).body
+
+    def render_one_pass():
+        return create_aliased_response(model).body
+
+    assert render_jsonable_encoder() == render_one_pass(), "response bodies differ"
+
+    print(f"{products_count} products, JSON_BACKEND={JSON_BACKEND}")
+    for name, func in (
+        ("jsonable_encoder", render_jsonable_encoder),
+        ("one pass", render_one_pass),
+    ):
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:>16}: {seconds / number * 1e3:.3f} ms per response")
+
+
+if __name__ == "__main__":
+    main()
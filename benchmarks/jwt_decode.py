@@ -0,0 +1,34 @@
+"""
+Per-request cost of turning an authorization token into TokenPayload,
+with a plain jwt.decode and with the decoded tokens cache.
+
+    python -m benchmarks.jwt_decode
+"""
+import timeit
+from datetime import timedelta
+
+import jwt
+
+from app.core.config import SECRET_KEY
+from app.core.jwt import ALGORITHM, _decode_token, create_access_token
+from app.models.token import TokenPayload
+
+
+def main(number: int = 100000):
+    token = create_access_token(
+        data={"email": "benchmark@example.com"}, expires_delta=timedelta(days=7)
+    )
+
+    def decode():
+        TokenPayload(**jwt.decode(token, str(SECRET_KEY), algorithms=[ALGORITHM]))
+
+    def decode_cached():
+        _decode_token(token)
+
+    for name, func in (("jwt.decode", decode), ("cached", decode_cached)):
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:>10}: {seconds / number * 1e6:.2f} us per request")
+
+
+if __name__ == "__main__":
+    main()
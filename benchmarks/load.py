@@ -0,0 +1,521 @@
+"""
+Load benchmark of the API against a local Postgres: virtual users run a mix of
+login, register, product list, product detail and favorite toggles, then the
+throughput and p50/p95/p99 of every operation are reported.
+
+    python -m benchmarks.load                       # ASGI app called in-process
+    python -m benchmarks.load --uvicorn             # through a uvicorn subprocess
+    python -m benchmarks.load --url http://host:80  # against a running server
+    python -m benchmarks.load --check               # exit 1 on regressions or errors
+    python -m benchmarks.load --save-baselines
+
+The database must be migrated with ``alembic upgrade head``, the products are
+seeded through the bulk import endpoint and reused by later runs. Baselines are
+stored per driver in benchmarks/baselines.json, record them on the machine the
+checks run on, with the load options the checks use. A check fails when the
+driver has no baselines or they were recorded with other options, when an
+operation has none, or when any request failed.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from slugify import slugify
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+PASSWORD = "benchmark-password"
+
+# relative weights of the operations each virtual user picks from
+OPERATIONS_MIX = {
+    "product list": 35,
+    "product detail": 40,
+    "favorite toggle": 15,
+    "login": 7,
+    "register": 3,
+}
+
+
+# arguments that shape the load, baselines are recorded and checked with the same
+LOAD_OPTIONS = ("users", "duration", "warmup", "products")
+
+
+class ASGIClient:
+    """
+    Calls the ASGI app in-process, without sockets or a server in between
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes = b""
+    ) -> Tuple[int, bytes]:
+        path, _, query_string = path.partition("?")
+        headers = dict(headers, **{"Content-Length": str(len(body))})
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "root_path": "",
+            "query_string": query_string.encode(),
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in headers.items()
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        status = 0
+        chunks = []
+        request_sent = False
+
+        async def receive() -> dict:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Future()  # nothing else arrives until the app is done
+
+        async def send(message: dict):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope)(receive, send)
+        return status, b"".join(chunks)
+
+    async def close(self):
+        pass
+
+
+class HTTPClient:
+    """
+    HTTP/1.1 client on one keep-alive connection, so a virtual user costs a socket
+    and no third party client library is needed
+    """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes = b""
+    ) -> Tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+
+        status_line = await self._reader.readline()
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding") == "chunked":
+            response_body = await self._read_chunked()
+        else:
+            length = int(response_headers.get("content-length", 0))
+            response_body = await self._reader.readexactly(length)
+
+        if response_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, response_body
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int((await self._reader.readline()).split(b";")[0], 16)
+            chunk = await self._reader.readexactly(size + 2)
+            if not size:
+                return b"".join(chunks)
+            chunks.append(chunk[:-2])
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = self._reader = None
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.recording = False
+
+    def record(self, operation: str, latency: float, ok: bool):
+        if not self.recording:
+            return
+        self.latencies[operation].append(latency)
+        if not ok:
+            self.errors[operation] += 1
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for operation, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            summary[operation] = {
+                "requests": len(latencies),
+                "errors": self.errors[operation],
+                "rps": len(latencies) / duration,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p95_ms": _percentile(latencies, 95) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+            }
+        return summary
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    # nearest rank, so a reported value was actually observed
+    index = max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def _json_body(data: dict) -> Tuple[Dict[str, str], bytes]:
+    return {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+async def _register(client, email: str) -> Tuple[int, Optional[str]]:
+    headers, body = _json_body(
+        {"client": {"name": email.split("@")[0], "email": email, "password": PASSWORD}}
+    )
+    status, response = await client.request("POST", "/api/clients", headers, body)
+    if status != 201:
+        return status, None
+    return status, json.loads(response)["client"]["token"]
+
+
+async def _login(client, email: str) -> Tuple[int, Optional[str]]:
+    headers, body = _json_body({"client": {"email": email, "password": PASSWORD}})
+    status, response = await client.request("POST", "/api/clients/login", headers, body)
+    if status != 200:
+        return status, None
+    return status, json.loads(response)["client"]["token"]
+
+
+async def _seed_products(client, products_count: int) -> List[str]:
+    email = "benchmark-seed@example.com"
+    status, token = await _register(client, email)
+    if token is None:
+        status, token = await _login(client, email)
+    if token is None:
+        raise RuntimeError(f"Could not authenticate the seeding client: {status}")
+
+    titles = [f"Benchmark product {i}" for i in range(products_count)]
+    lines = [
+        json.dumps(
+            {
+                "title": title,
+                "brand": f"Brand {i % 50}",
+                "image": f"https://example.com/images/{i}.png",
+                "preco": f"{(i % 1000) + 0.99:.2f}",
+                "reviewScore": f"{(i % 50) / 10:.1f}",
+            }
+        )
+        for i, title in enumerate(titles)
+    ]
+    status, response = await client.request(
+        "POST",
+        "/api/products/import?onConflict=skip",
+        {"Authorization": f"Token {token}", "Content-Type": "application/x-ndjson"},
+        "\n".join(lines).encode(),
+    )
+    if status != 200:
+        raise RuntimeError(f"Seeding products failed with {status}: {response[:200]}")
+    return [slugify(title) for title in titles]
+
+
+async def _virtual_user(
+    client, index: int, run_id: str, slugs: List[str], stats: Stats, deadline: float
+):
+    rng = random.Random(index)
+    # a few products get most of the detail views, like a real catalogue
+    slug_weights = [1 / (rank + 1) for rank in range(len(slugs))]
+    operations, weights = zip(*OPERATIONS_MIX.items())
+    registered = 0
+
+    async def timed(operation: str, method: str, path: str, headers: dict, body=b""):
+        started = time.perf_counter()
+        status, response = await client.request(method, path, headers, body)
+        stats.record(operation, time.perf_counter() - started, status < 400)
+        return status, response
+
+    email = f"benchmark-{run_id}-{index}@example.com"
+    status, token = await _register(client, email)
+    if token is None:
+        raise RuntimeError(f"Could not register virtual user {index}: {status}")
+    favorites = set()
+
+    while time.monotonic() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        auth = {"Authorization": f"Token {token}"}
+
+        if operation == "product list":
+            query = {"limit": 20}
+            if rng.random() < 0.3:
+                query["brand"] = f"Brand {rng.randrange(50)}"
+            await timed(operation, "GET", f"/api/products?{urlencode(query)}", auth)
+        elif operation == "product detail":
+            slug = rng.choices(slugs, slug_weights)[0]
+            await timed(operation, "GET", f"/api/products/{slug}", auth)
+        elif operation == "favorite toggle":
+            slug = rng.choices(slugs, slug_weights)[0]
+            method = "DELETE" if slug in favorites else "POST"
+            status, _ = await timed(
+                operation, method, f"/api/products/{slug}/favorite", auth
+            )
+            if status < 400:
+                favorites.symmetric_difference_update({slug})
+        elif operation == "login":
+            started = time.perf_counter()
+            status, _ = await _login(client, email)
+            stats.record(operation, time.perf_counter() - started, status < 400)
+        elif operation == "register":
+            registered += 1
+            started = time.perf_counter()
+            status, _ = await _register(client, f"{registered}-{email}")
+            stats.record(operation, time.perf_counter() - started, status < 400)
+
+
+async def _run_load(make_client, args) -> Dict[str, Dict[str, float]]:
+    seed_client = make_client()
+    try:
+        slugs = await _seed_products(seed_client, args.products)
+    finally:
+        await seed_client.close()
+
+    stats = Stats()
+    run_id = uuid.uuid4().hex[:8]
+    clients = [make_client() for _ in range(args.users)]
+    started = time.monotonic()
+    deadline = started + args.warmup + args.duration
+
+    async def start_recording():
+        await asyncio.sleep(args.warmup)
+        stats.recording = True
+
+    try:
+        recorder = asyncio.ensure_future(start_recording())
+        await asyncio.gather(
+            *(
+                _virtual_user(client, index, run_id, slugs, stats, deadline)
+                for index, client in enumerate(clients)
+            )
+        )
+        await recorder
+    finally:
+        for client in clients:
+            await client.close()
+
+    return stats.summary(args.duration)
+
+
+async def _run_in_process(args) -> Dict[str, Dict[str, float]]:
+    from app.db.db_utils import close_postgres_connection, connect_to_postgres
+    from app.main import app
+
+    await connect_to_postgres()
+    try:
+        return await _run_load(lambda: ASGIClient(app), args)
+    finally:
+        await close_postgres_connection()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def _run_over_uvicorn(args) -> Dict[str, Dict[str, float]]:
+    port = _free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ]
+    )
+    try:
+        await _wait_for_port(port)
+        return await _run_load(lambda: HTTPClient(f"http://127.0.0.1:{port}"), args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _print_summary(driver: str, summary: Dict[str, Dict[str, float]]):
+    print(f"driver: {driver}")
+    print(
+        f"{'operation':>16} {'requests':>9} {'errors':>7} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for operation, result in summary.items():
+        print(
+            f"{operation:>16} {result['requests']:>9} {result['errors']:>7} "
+            f"{result['rps']:>8.1f} {result['p50_ms']:>8.2f} "
+            f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+        )
+
+
+def _load_baselines() -> dict:
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as baselines_file:
+        return json.load(baselines_file)
+
+
+def _load_options(args) -> Dict[str, float]:
+    # results are only comparable between runs of the same load
+    return {name: getattr(args, name) for name in LOAD_OPTIONS}
+
+
+def _check_regressions(
+    driver: str, summary: Dict[str, Dict[str, float]], args
+) -> List[str]:
+    stored = _load_baselines().get(driver)
+    if not stored:
+        return [f"no baselines stored for the {driver} driver, record them first"]
+    if stored["options"] != _load_options(args):
+        options = " ".join(
+            f"--{name} {value:g}" for name, value in stored["options"].items()
+        )
+        return [f"baselines of the {driver} driver were recorded with {options}"]
+
+    baselines = stored["operations"]
+    tolerance = args.tolerance
+    regressions = []
+    for operation, result in summary.items():
+        if operation not in baselines:
+            regressions.append(f"{operation}: no baseline stored")
+        if result["errors"]:
+            regressions.append(
+                f"{operation}: {result['errors']} of {result['requests']} "
+                f"requests failed"
+            )
+
+    for operation, baseline in baselines.items():
+        result = summary.get(operation)
+        if result is None:
+            regressions.append(f"{operation}: no requests were made")
+            continue
+        if result["p95_ms"] > baseline["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{operation}: p95 {result['p95_ms']:.2f} ms, "
+                f"baseline {baseline['p95_ms']:.2f} ms"
+            )
+        if result["rps"] < baseline["rps"] * (1 - tolerance):
+            regressions.append(
+                f"{operation}: {result['rps']:.1f} req/s, "
+                f"baseline {baseline['rps']:.1f} req/s"
+            )
+    return regressions
+
+
+def _save_baselines(driver: str, summary: Dict[str, Dict[str, float]], args):
+    baselines = _load_baselines()
+    baselines[driver] = {
+        "options": _load_options(args),
+        "operations": {
+            operation: {
+                "p95_ms": round(result["p95_ms"], 3),
+                "rps": round(result["rps"], 1),
+            }
+            for operation, result in summary.items()
+        },
+    }
+    with open(BASELINES_PATH, "w") as baselines_file:
+        json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+        baselines_file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    driver_group = parser.add_mutually_exclusive_group()
+    driver_group.add_argument("--uvicorn", action="store_true")
+    driver_group.add_argument("--url")
+    # the options the committed baselines were recorded with
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baselines", action="store_true")
+    args = parser.parse_args()
+
+    if args.url:
+        driver = "http"
+        summary = asyncio.run(_run_load(lambda: HTTPClient(args.url), args))
+    elif args.uvicorn:
+        driver = "uvicorn"
+        summary = asyncio.run(_run_over_uvicorn(args))
+    else:
+        driver = "asgi"
+        summary = asyncio.run(_run_in_process(args))
+
+    _print_summary(driver, summary)
+
+    if args.save_baselines:
+        failed = [operation for operation in summary if summary[operation]["errors"]]
+        if failed:
+            sys.exit(f"Not saving baselines, requests failed: {', '.join(failed)}")
+        _save_baselines(driver, summary, args)
+        print(f"Baselines of the {driver} driver saved to {BASELINES_PATH}")
+
+    if args.check:
+        regressions = _check_regressions(driver, summary, args)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
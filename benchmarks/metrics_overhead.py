@@ -0,0 +1,90 @@
+"""
+Per-request cost of the metrics middleware and per-call cost of the crud
+latency decorator, both measured against the same work without metrics.
+
+    python -m benchmarks.metrics_overhead
+    PROMETHEUS_MULTIPROC_DIR=$(mktemp -d) python -m benchmarks.metrics_overhead
+"""
+import asyncio
+import time
+
+from app.core.metrics import track_query_latency
+from app.core.middleware import MetricsMiddleware
+
+
+class _Route:
+    path = "/api/products/{slug}"
+
+    @staticmethod
+    def endpoint():
+        pass
+
+
+class _Router:
+    routes = [_Route]
+
+
+def _app(scope):
+    async def asgi(receive, send):
+        scope["endpoint"] = _Route.endpoint
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return asgi
+
+
+async def _receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def _send(message):
+    pass
+
+
+async def _time_requests(app, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        scope = {"type": "http", "method": "GET", "router": _Router}
+        await app(scope)(_receive, _send)
+    return time.perf_counter() - started
+
+
+async def _query():
+    pass
+
+
+async def _time_calls(func, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        await func()
+    return time.perf_counter() - started
+
+
+async def run(number: int):
+    wrapped_app = MetricsMiddleware(_app)
+    wrapped_query = track_query_latency(_query)
+
+    for name, plain, measured in (
+        (
+            "middleware",
+            lambda: _time_requests(_app, number),
+            lambda: _time_requests(wrapped_app, number),
+        ),
+        (
+            "crud decorator",
+            lambda: _time_calls(_query, number),
+            lambda: _time_calls(wrapped_query, number),
+        ),
+    ):
+        plain_seconds = min([await plain() for _ in range(5)])
+        measured_seconds = min([await measured() for _ in range(5)])
+        overhead = (measured_seconds - plain_seconds) / number * 1e6
+        print(f"{name:>14}: {overhead:.2f} us overhead per call")
+
+
+def main(number: int = 100000):
+    asyncio.run(run(number))
+
+
+if __name__ == "__main__":
+    main()
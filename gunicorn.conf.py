@@ -0,0 +1,65 @@
+"""
+gunicorn settings shared by the Procfile and the Dockerfile.
+
+The app is preloaded, so imports and route compilation happen once in the
+master and the workers share them after the fork. Each worker opens its own
+database pools on startup.
+
+Each worker keeps its prometheus metrics in files of a directory shared by
+all workers, so whichever worker answers /metrics adds them up for the
+whole server.
+"""
+import glob
+import os
+import tempfile
+import time
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+_started = time.perf_counter()
+
+# set up before the app is preloaded, it reads the directory when importing
+# prometheus_client, older releases only know the lowercase name
+_metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get(
+    "prometheus_multiproc_dir"
+)
+if not _metrics_dir:
+    _metrics_dir = tempfile.mkdtemp(prefix="prometheus-")
+
+# files left by a previous run would be added to the new counters
+for path in glob.glob(os.path.join(_metrics_dir, "*.db")):
+    os.remove(path)
+
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = _metrics_dir
+os.environ["prometheus_multiproc_dir"] = _metrics_dir
+
+
+def when_ready(server):
+    server.log.info(
+        f"Master ready in {(time.perf_counter() - _started) * 1000:.1f} ms"
+        f" (preload_app={server.cfg.preload_app})"
+    )
+
+
+def pre_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    worker.log.info(
+        f"Worker {worker.pid} booted in"
+        f" {(time.perf_counter() - worker.forked_at) * 1000:.1f} ms"
+    )
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+
+    # live gauges of the dead worker must not be summed anymore
+    multiprocess.mark_process_dead(worker.pid)
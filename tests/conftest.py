@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import asyncpg
+import pytest
+from starlette.testclient import TestClient
+
+from app.core.config import DATABASE_URL
+
+
+def _database_skip_reason() -> Optional[str]:
+    async def check() -> Optional[str]:
+        conn = await asyncpg.connect(str(DATABASE_URL), timeout=5)
+        try:
+            if not await conn.fetchval("SELECT to_regclass('alembic_version')"):
+                return "Database is not migrated, run alembic upgrade head"
+        finally:
+            await conn.close()
+
+    try:
+        return asyncio.get_event_loop().run_until_complete(check())
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+        return f"No database reachable at {DATABASE_URL!r}"
+
+
+@pytest.fixture(scope="session")
+def client() -> TestClient:
+    """
+    Client of the app started against the migrated database of DATABASE_URL,
+    the tests are skipped when it cannot be reached or is not migrated
+    """
+    skip_reason = _database_skip_reason()
+    if skip_reason:
+        pytest.skip(skip_reason)
+
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def run():
+    # the app runs its startup and requests on this loop, so the pools work here too
+    return asyncio.get_event_loop().run_until_complete
+
+
+@pytest.fixture
+def traced_statements(monkeypatch) -> Set[str]:
+    """
+    Names of the registered statements and fingerprints of the other queries
+    run during the test
+    """
+    from app.db import connection
+
+    statements = set()
+    record_query = connection.record_query
+
+    def record(fingerprint: str, duration: float, rows: int):
+        statements.add(fingerprint)
+        record_query(fingerprint, duration, rows)
+
+    monkeypatch.setattr(connection, "record_query", record)
+    return statements
+
+
+@pytest.fixture
+def register(client: TestClient) -> Callable[[], Tuple[str, Dict[str, str]]]:
+    """
+    Registers a new client on every call, returns its email and auth headers
+    """
+
+    def register() -> Tuple[str, Dict[str, str]]:
+        email = f"test-{uuid.uuid4().hex[:12]}@example.com"
+        response = client.post(
+            "/api/clients",
+            json={"client": {"name": email, "email": email, "password": "secret"}},
+        )
+        assert response.status_code == 201, response.text
+        token = response.json()["client"]["token"]
+        return email, {"Authorization": f"Token {token}"}
+
+    return register
@@ -0,0 +1,21 @@
+def _login(client, email: str, password: str):
+    return client.post(
+        "/api/clients/login", json={"client": {"email": email, "password": password}}
+    )
+
+
+def test_registered_client_logs_in(client, register):
+    email, _ = register()
+    assert _login(client, email, "secret").status_code == 200
+    assert _login(client, email, "wrong").status_code == 400
+
+
+def test_updated_password_replaces_the_old_one(client, register):
+    email, headers = register()
+    response = client.put(
+        "/api/client", json={"client": {"password": "changed"}}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+
+    assert _login(client, email, "changed").status_code == 200
+    assert _login(client, email, "secret").status_code == 400
@@ -0,0 +1,129 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.api.api_v1.endpoints import client as client_endpoints
+from app.crud import favorites_buffer as favorites_buffer_module
+from app.crud.favorites_buffer import FavoritesBuffer
+from app.crud.product import is_product_favorited_by_client
+from app.db.database import db
+
+
+@pytest.fixture
+def product_slug(client, register) -> str:
+    _, headers = register()
+    title = f"Buffered product {uuid.uuid4().hex[:12]}"
+    response = client.post(
+        "/api/products",
+        json={
+            "product": {
+                "title": title,
+                "brand": "Buffered",
+                "image": "https://example.com/buffered.png",
+                "preco": "1.00",
+                "reviewScore": "1.0",
+            }
+        },
+        headers=headers,
+    )
+    assert response.status_code < 300, response.text
+    return response.json()["product"]["slug"]
+
+
+@pytest.fixture
+def buffer(run) -> FavoritesBuffer:
+    # flushed by the tests themselves, the interval only paces the retry
+    buffer = FavoritesBuffer(flush_interval=0.01, flush_size=1000)
+    task = buffer.start()
+    yield buffer
+    task.cancel()
+    run(asyncio.gather(task, return_exceptions=True))
+
+
+async def _is_favorited(slug: str, email: str) -> bool:
+    async with db.pool.acquire() as conn:
+        return await is_product_favorited_by_client(conn, slug, email)
+
+
+def test_flush_waits_for_flush_in_flight(run, register, buffer, product_slug):
+    email, _ = register()
+    buffer.add(email, product_slug, True)
+
+    async def flush_twice():
+        in_flight = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        assert not len(buffer) and buffer.pending(email, product_slug)
+
+        # nothing is queued anymore, but the intent is not written yet
+        await buffer.flush()
+        assert in_flight.done()
+        return await _is_favorited(product_slug, email)
+
+    assert run(flush_twice())
+    assert buffer.pending(email, product_slug) is None
+
+
+def test_failed_flush_is_retried_once(
+    run, register, buffer, product_slug, monkeypatch
+):
+    email, _ = register()
+    apply_favorite_intents = favorites_buffer_module.apply_favorite_intents
+    attempts = []
+
+    async def fail_once(*args):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise ConnectionResetError("connection lost")
+        await apply_favorite_intents(*args)
+
+    monkeypatch.setattr(favorites_buffer_module, "apply_favorite_intents", fail_once)
+    buffer.add(email, product_slug, True)
+    run(buffer.flush())
+
+    assert len(attempts) == 2
+    assert run(_is_favorited(product_slug, email))
+
+
+def test_intents_are_dropped_after_second_failure(
+    run, register, buffer, product_slug, monkeypatch
+):
+    email, _ = register()
+
+    async def fail(*args):
+        raise ConnectionResetError("connection lost")
+
+    monkeypatch.setattr(favorites_buffer_module, "apply_favorite_intents", fail)
+    dropped = []
+    monkeypatch.setattr(
+        favorites_buffer_module.FAVORITE_INTENTS_DROPPED, "inc", dropped.append
+    )
+    buffer.add(email, product_slug, True)
+    run(buffer.flush())
+
+    assert dropped == [1]
+    assert buffer.pending(email, product_slug) is None
+    assert not run(_is_favorited(product_slug, email))
+
+
+def test_favorites_list_waits_for_flush_in_flight(
+    client, register, buffer, product_slug, monkeypatch
+):
+    email, headers = register()
+    apply_favorite_intents = favorites_buffer_module.apply_favorite_intents
+
+    async def slow_apply(*args):
+        await asyncio.sleep(0.2)
+        await apply_favorite_intents(*args)
+
+    monkeypatch.setattr(favorites_buffer_module, "apply_favorite_intents", slow_apply)
+    monkeypatch.setattr(client_endpoints, "favorites_buffer", buffer)
+    buffer.add(email, product_slug, True)
+    # starts before the request is handled, and is still writing when the list reads
+    in_flight = asyncio.ensure_future(buffer.flush())
+
+    response = client.get("/api/client/favorites", headers=headers)
+    assert response.status_code == 200, response.text
+    assert in_flight.done()
+    slugs = [favorite["product"]["slug"] for favorite in response.json()["favorites"]]
+    assert slugs == [product_slug]
@@ -0,0 +1,48 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+from app.core.config import DATABASE_URL
+from app.db.connection import Connection
+from app.db.pool import AdaptiveLimiter, InstrumentedPool
+
+
+@pytest.fixture
+def pool(client, run) -> InstrumentedPool:
+    # the client only checks the database and sets up the loop
+    pool = run(
+        asyncpg.create_pool(
+            str(DATABASE_URL), min_size=0, max_size=3, connection_class=Connection
+        )
+    )
+    limiter = AdaptiveLimiter(1, 3, target_wait=1, interval=60)
+    yield InstrumentedPool(pool, "top_up_test", limiter=limiter)
+    run(pool.close())
+
+
+def test_top_up_leaves_a_connection_to_handlers(run, pool):
+    run(pool.top_up(3))
+    assert pool.size == 2
+    assert pool.in_use == 0
+
+
+def test_top_up_takes_nothing_while_enough_are_open(run, pool, monkeypatch):
+    run(pool.top_up(2))
+    taken = []
+    monkeypatch.setattr(type(pool._pool), "acquire", taken.append)
+    run(pool.top_up(2))
+    assert not taken
+
+
+def test_top_up_stops_while_handlers_wait(run, pool):
+    async def top_up_behind_handlers():
+        async with pool.acquire():
+            waiting = asyncio.ensure_future(pool.limiter.acquire())
+            await asyncio.sleep(0)
+            await pool.top_up(3)
+            waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    run(top_up_behind_handlers())
+    assert pool.size == 1
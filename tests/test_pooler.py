@@ -0,0 +1,152 @@
+"""
+Runs every registered statement, the bulk import and the cursor streamed list
+through a transaction-mode pooler, where consecutive transactions of a pool
+connection may land on different server connections. Start it with
+DB_POOLER_MODE=transaction and DATABASE_URL pointing at the pooler, see README.
+"""
+import json
+import uuid
+
+import pytest
+from slugify import slugify
+
+from app.core.config import DB_POOLER_MODE
+from app.crud.client import get_client, get_client_by_email, update_client_password
+from app.crud.product import (
+    apply_favorite_intents,
+    get_favorites_count_for_product,
+    reconcile_favorites_counts,
+)
+from app.db.connection import CURSOR_PREFETCH
+from app.db.database import db
+from app.db.statements import registered_statements
+
+pytestmark = pytest.mark.skipif(
+    DB_POOLER_MODE != "transaction", reason="DB_POOLER_MODE is not transaction"
+)
+
+
+def _product(title: str) -> dict:
+    return {
+        "title": title,
+        "brand": "Pooler",
+        "image": "https://example.com/pooler.png",
+        "preco": "10.50",
+        "reviewScore": "4.5",
+    }
+
+
+async def _run_maintenance_statements(email: str, slug: str):
+    # statements no endpoint runs, they belong to commands and the write-behind mode
+    async with db.pool.acquire() as conn:
+        dbclient = await get_client_by_email(conn, email)
+        assert await get_client(conn, dbclient.name)
+        await update_client_password(conn, dbclient)
+
+        assert await get_favorites_count_for_product(conn, slug) == 0
+        await apply_favorite_intents(conn, [email], [slug], [True])
+        assert await get_favorites_count_for_product(conn, slug) == 1
+        await reconcile_favorites_counts(conn, after_id=0, batch_size=1)
+
+
+async def _stream_named_statements() -> int:
+    # asyncpg names the statements it prepares __asyncpg_stmt_N__
+    rows_count = CURSOR_PREFETCH * 2 + 1
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            rows = [
+                row["g"]
+                async for row in conn.cursor_query(
+                    "SELECT g FROM generate_series(1, $1::int) g", rows_count
+                )
+            ]
+            assert rows == list(range(1, rows_count + 1))
+            return await conn.fetchval(
+                "SELECT count(*) FROM pg_prepared_statements "
+                "WHERE name LIKE '\\_\\_asyncpg\\_%'"
+            )
+
+
+def test_stream_leaves_no_named_statements(client, run):
+    # they would outlive the transaction on the server connection
+    assert run(_stream_named_statements()) == 0
+
+
+def test_statements_run_through_transaction_pooler(
+    client, register, run, traced_statements
+):
+    email, headers = register()
+    response = client.post(
+        "/api/clients/login", json={"client": {"email": email, "password": "secret"}}
+    )
+    assert response.status_code == 200, response.text
+
+    response = client.put(
+        "/api/client", json={"client": {"name": f"renamed-{email}"}}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+
+    title = f"Pooler product {uuid.uuid4().hex[:12]}"
+    slug = slugify(title)
+    response = client.post(
+        "/api/products", json={"product": _product(title)}, headers=headers
+    )
+    assert response.status_code < 300, response.text
+
+    imported = [_product(f"{title} imported {i}") for i in range(3)]
+    response = client.post(
+        "/api/products/import",
+        data="\n".join(json.dumps(product) for product in imported),
+        headers=dict(headers, **{"Content-Type": "application/x-ndjson"}),
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["result"]["inserted"] == 3
+
+    response = client.put(
+        f"/api/products/{slug}", json={"product": {"brand": "Pooled"}}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+
+    response = client.get(f"/api/products/{slug}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["product"]["brand"] == "Pooled"
+
+    response = client.post(f"/api/products/{slug}/favorite", headers=headers)
+    assert response.status_code == 200, response.text
+    response = client.delete(f"/api/products/{slug}/favorite", headers=headers)
+    assert response.status_code == 200, response.text
+
+    imported_slugs = [slugify(product["title"]) for product in imported]
+    response = client.post(
+        "/api/products/favorites",
+        json={"favorites": {"add": imported_slugs, "remove": [slug]}},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+
+    response = client.get("/api/client/favorites", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["favoritesCount"] == 3
+
+    response = client.get(
+        "/api/products", params={"brand": "Pooler", "limit": 2}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["productsCount"] == 2
+
+    # the stream reads through a server-side cursor inside one transaction
+    response = client.get(
+        "/api/products",
+        params={"title": title, "stream": "true"},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["productsCount"] == 4
+
+    run(_run_maintenance_statements(email, slug))
+
+    response = client.delete(f"/api/products/{slug}", headers=headers)
+    assert response.status_code == 204, response.text
+
+    missing = set(registered_statements()) - traced_statements
+    assert not missing, f"Registered statements never ran: {sorted(missing)}"
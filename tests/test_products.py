@@ -0,0 +1,125 @@
+import uuid
+
+import pytest
+from starlette.testclient import TestClient
+
+from app.api.api_v1.endpoints import product as product_endpoints
+from app.crud.favorites_buffer import FavoritesBuffer
+from app.db.pool import InstrumentedPool
+
+PRODUCT_KEYS = {
+    "title",
+    "brand",
+    "image",
+    "preco",
+    "reviewScore",
+    "createdAt",
+    "updatedAt",
+    "slug",
+    "favorited",
+    "favoritesCount",
+}
+
+
+@pytest.fixture
+def product(client: TestClient, register) -> dict:
+    _, headers = register()
+    response = client.post(
+        "/api/products",
+        json={
+            "product": {
+                "title": f"Rendered product {uuid.uuid4().hex[:12]}",
+                "brand": "Rendered",
+                "image": "https://example.com/rendered.png",
+                "preco": "1.00",
+                "reviewScore": "1.0",
+            }
+        },
+        headers=headers,
+    )
+    assert response.status_code < 300, response.text
+    return response.json()["product"]
+
+
+def test_product_payloads_leave_out_the_row_columns(client, register, product):
+    _, headers = register()
+    assert set(product) == PRODUCT_KEYS
+
+    response = client.get(f"/api/products/{product['slug']}", headers=headers)
+    assert set(response.json()["product"]) == PRODUCT_KEYS
+
+    for stream in ("false", "true"):
+        response = client.get(
+            "/api/products", params={"title": product["title"], "stream": stream}
+        )
+        assert [set(p) for p in response.json()["products"]] == [PRODUCT_KEYS]
+
+    response = client.post(f"/api/products/{product['slug']}/favorite", headers=headers)
+    assert set(response.json()["product"]) == PRODUCT_KEYS
+    response = client.get("/api/client/favorites", headers=headers)
+    favorites = response.json()["favorites"]
+    assert [set(f["product"]) for f in favorites] == [PRODUCT_KEYS]
+
+
+def test_product_detail_takes_one_connection(client, register, product, monkeypatch):
+    _, headers = register()
+    # the client is looked up once, then cached
+    assert client.get("/api/client", headers=headers).status_code == 200
+
+    acquires = []
+    _acquire = InstrumentedPool._acquire
+
+    async def acquire(self, timeout):
+        acquires.append(self.name)
+        return await _acquire(self, timeout)
+
+    monkeypatch.setattr(InstrumentedPool, "_acquire", acquire)
+    # the first read loads the product, the second finds it cached
+    for _ in range(2):
+        response = client.get(f"/api/products/{product['slug']}", headers=headers)
+        assert response.status_code == 200, response.text
+    assert len(acquires) == 2
+
+
+def test_streamed_products_show_queued_favorites(
+    client, register, product, monkeypatch
+):
+    email, headers = register()
+    # never started, the intent stays queued
+    buffer = FavoritesBuffer(flush_interval=60, flush_size=100)
+    buffer.add(email, product["slug"], True)
+    monkeypatch.setattr(product_endpoints, "favorites_buffer", buffer)
+
+    response = client.get(
+        "/api/products",
+        params={"title": product["title"], "stream": "true"},
+        headers=headers,
+    )
+    [streamed] = response.json()["products"]
+    assert streamed["favorited"] is True
+    assert streamed["favoritesCount"] == 1
+
+
+def test_favorited_filter_takes_the_client_email(client, product):
+    # names are not unique, a second client with the same one favorites nothing
+    tokens = {}
+    for _ in range(2):
+        email = f"test-{uuid.uuid4().hex[:12]}@example.com"
+        response = client.post(
+            "/api/clients",
+            json={"client": {"name": "Same Name", "email": email, "password": "x"}},
+        )
+        assert response.status_code == 201, response.text
+        tokens[email] = response.json()["client"]["token"]
+
+    favoriting, other = tokens
+    response = client.post(
+        "/api/products/favorites",
+        json={"favorites": {"add": [product["slug"]]}},
+        headers={"Authorization": f"Token {tokens[favoriting]}"},
+    )
+    assert response.status_code == 200, response.text
+
+    for email, slugs in ((favoriting, [product["slug"]]), (other, [])):
+        response = client.get("/api/products", params={"favorited": email})
+        assert [p["slug"] for p in response.json()["products"]] == slugs
@@ -0,0 +1,109 @@
+"""
+Statements run per request, as reported by the Server-Timing header of the query
+tracing. Reading more products or favorites must not cost more round trips.
+"""
+import json
+import re
+import uuid
+from typing import List
+
+import pytest
+from slugify import slugify
+from starlette.testclient import TestClient
+
+from app.core.config import QUERY_TRACING
+
+pytestmark = pytest.mark.skipif(not QUERY_TRACING, reason="QUERY_TRACING is off")
+
+_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def _query_count(response) -> int:
+    assert response.status_code == 200, response.text
+    return int(_QUERIES_RE.search(response.headers["server-timing"]).group(1))
+
+
+@pytest.fixture
+def products(client: TestClient, register) -> List[str]:
+    _, headers = register()
+    title = f"Counted product {uuid.uuid4().hex[:12]}"
+    lines = [
+        json.dumps(
+            {
+                "title": f"{title} {i}",
+                "brand": "Counted",
+                "image": "https://example.com/counted.png",
+                "preco": "1.00",
+                "reviewScore": "1.0",
+            }
+        )
+        for i in range(5)
+    ]
+    response = client.post(
+        "/api/products/import",
+        data="\n".join(lines),
+        headers=dict(headers, **{"Content-Type": "application/x-ndjson"}),
+    )
+    assert response.status_code == 200, response.text
+    return [slugify(f"{title} {i}") for i in range(5)]
+
+
+def _favorite(client: TestClient, headers: dict, slugs: List[str]):
+    response = client.post(
+        "/api/products/favorites", json={"favorites": {"add": slugs}}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize("authenticated", [False, True])
+def test_product_list_queries_do_not_grow_with_page(
+    client, register, products, authenticated
+):
+    headers = {}
+    if authenticated:
+        _, headers = register()
+        _favorite(client, headers, products[:3])
+
+    # the titles only differ by their last word
+    title = products[0].rsplit("-", 1)[0].replace("-", " ")
+    counts = []
+    for limit in (1, 5):
+        response = client.get(
+            "/api/products", params={"title": title, "limit": limit}, headers=headers
+        )
+        assert len(response.json()["products"]) == limit
+        counts.append(_query_count(response))
+    assert counts[0] == counts[1]
+
+
+def test_product_detail_queries_do_not_grow_with_favorites(client, register, products):
+    _, headers = register()
+    for _ in range(3):
+        _, favoriting_headers = register()
+        _favorite(client, favoriting_headers, products[:1])
+    # the first request of a client also looks the client up
+    _query_count(client.get("/api/client", headers=headers))
+
+    counts = [
+        _query_count(client.get(f"/api/products/{slug}", headers=headers))
+        for slug in products[:2]
+    ]
+    assert counts[0] == counts[1]
+
+
+def test_client_favorites_queries_do_not_grow_with_favorites(
+    client, register, products
+):
+    counts = []
+    for favorites_count in (1, 5):
+        _, headers = register()
+        _favorite(client, headers, products[:favorites_count])
+        response = client.get("/api/client/favorites", headers=headers)
+        assert len(response.json()["favorites"]) == favorites_count
+        counts.append(_query_count(response))
+    assert counts[0] == counts[1]
+
+
+def test_cached_product_detail_runs_no_query(client, products):
+    client.get(f"/api/products/{products[0]}")
+    assert _query_count(client.get(f"/api/products/{products[0]}")) == 0
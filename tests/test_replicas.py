@@ -0,0 +1,70 @@
+import time
+from collections import deque
+
+import pytest
+
+from app.db import database
+from app.db.database import DataBase
+from app.db.db_utils import _replica_lag
+
+
+@pytest.fixture
+def samples() -> deque:
+    # primary WAL positions 10, 20 and 30 sampled 3, 2 and 1 seconds ago
+    now = time.monotonic()
+    return deque([(now - 3, 10), (now - 2, 20), (now - 1, 30)])
+
+
+def test_primary_has_no_lag(samples):
+    assert _replica_lag(samples, in_recovery=False, replayed=None) == 0.0
+
+
+def test_replica_that_replayed_nothing_has_no_lag_measured(samples):
+    assert _replica_lag(samples, in_recovery=True, replayed=None) is None
+
+
+def test_lag_runs_from_the_oldest_position_not_replayed(samples):
+    assert _replica_lag(samples, True, 15) == pytest.approx(2, abs=0.5)
+    assert _replica_lag(samples, True, 20) == pytest.approx(1, abs=0.5)
+
+
+def test_replica_that_replayed_every_sample_has_no_lag(samples):
+    assert _replica_lag(samples, True, 30) == 0.0
+    assert _replica_lag(deque(), True, 0) == 0.0
+
+
+@pytest.fixture
+def db(monkeypatch) -> DataBase:
+    monkeypatch.setattr(database, "REPLICA_MAX_LAG_SECONDS", 1.0)
+    db = DataBase()
+    db.pool = "primary"
+    db.replica_pools = ["replica 0", "replica 1", "replica 2"]
+    return db
+
+
+def test_reads_skip_lagging_and_unmeasured_replicas(db):
+    db.replica_lags = [0.5, 2.0, None]
+    assert {db.read_pool() for _ in range(4)} == {"replica 0"}
+
+
+def test_reads_take_the_replicas_in_turn(db):
+    db.replica_lags = [0.0, 1.0, 0.2]
+    assert [db.read_pool() for _ in range(3)] == db.replica_pools
+
+
+def test_reads_fall_back_to_the_primary(db):
+    db.replica_lags = [1.5, None, 3.0]
+    assert db.read_pool() == "primary"
+    assert db.read_pool("client@example.com") == "primary"
+
+    db.replica_pools, db.replica_lags = [], []
+    assert db.read_pool() == "primary"
+
+
+def test_recent_writers_read_from_the_primary(db):
+    db.replica_lags = [0.0, 0.0, 0.0]
+    db.mark_written("writer@example.com")
+
+    assert db.read_pool("writer@example.com") == "primary"
+    assert db.read_pool("reader@example.com") in db.replica_pools
+    assert db.read_pool() in db.replica_pools
@@ -0,0 +1,50 @@
+import uuid
+
+import pytest
+
+from app.db import statements
+from app.db.database import db
+from app.db.db_utils import PREPARED_STATEMENTS
+
+pytestmark = pytest.mark.skipif(
+    not PREPARED_STATEMENTS, reason="statements are not prepared behind the pooler"
+)
+
+
+@pytest.fixture
+def table(client, run, monkeypatch) -> str:
+    table = f"statements_test_{uuid.uuid4().hex[:12]}"
+
+    async def execute(query: str):
+        async with db.pool.acquire() as conn:
+            await conn.execute(query)
+
+    run(execute(f"CREATE TABLE {table} (a int)"))
+    run(execute(f"INSERT INTO {table} VALUES (1)"))
+    # registered for this test only, the pooler test expects every statement to run
+    monkeypatch.setitem(statements._statements, table, f"SELECT * FROM {table}")
+    yield table
+    run(execute(f"DROP TABLE {table}"))
+
+
+async def _fetch(name: str) -> list:
+    async with db.pool.acquire() as conn:
+        return [tuple(row) for row in await conn.fetch_prepared(name)]
+
+
+def test_statement_runs_again_after_release(run, table):
+    assert run(_fetch(table)) == [(1,)]
+    assert run(_fetch(table)) == [(1,)]
+
+
+def test_statement_is_prepared_again_after_migration(run, table):
+    async def fetch_around_migration() -> list:
+        async with db.pool.acquire() as conn:
+            assert [tuple(row) for row in await conn.fetch_prepared(table)] == [(1,)]
+            async with db.pool.acquire() as other_conn:
+                await other_conn.execute(
+                    f"ALTER TABLE {table} ADD COLUMN b int DEFAULT 2"
+                )
+            return [tuple(row) for row in await conn.fetch_prepared(table)]
+
+    assert run(fetch_around_migration()) == [(1, 2)]